@@ -1,21 +1,56 @@
 import os
 import subprocess
 import re  # For basic regex validation
-from flask import Flask, request, redirect, Response, render_template_string, flash, url_for, session, make_response
+from flask import Flask, Request, request, redirect, Response, flash, url_for, session, make_response, send_file, send_from_directory, g, has_request_context, stream_with_context
+from flask.sessions import SecureCookieSessionInterface
+from flask.templating import _render as render_flask_template
+from itsdangerous import URLSafeTimedSerializer
 from markupsafe import Markup, escape
 import pickle
 import hashlib
+import gzip
+import zlib
+import hmac
 import base64
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.local import LocalProxy
 import time  # For timestamp generation
 import random  # For session token generation
 import json  # For user data serialization
+import click
 import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta
 import jwt
-from urllib.request import urlopen
+from urllib.request import getproxies, proxy_bypass, urlopen
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit, urljoin, quote, unquote
+import http.client
+import codecs
+import ssl
 from io import BytesIO
 import sys
+import argparse
+import gc
+import selectors
+import shutil
+import signal
+import socket
+import cProfile
+import threading
+import tempfile
+import sqlite3
+import uuid
+import bisect
+import contextlib
+import abc
+import fcntl
+import struct
+import binascii
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
 UPLOAD_FOLDER = './uploads'
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'py', 'html'}
@@ -23,22 +58,514 @@ ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'py', 'html'}
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['SECRET_KEY'] = 'trendy-tees-session-key-789' # Still hardcoded
+app.config['UPLOAD_MAX_SIZE'] = int(os.environ.get('UPLOAD_MAX_SIZE', 16 * 1024 * 1024)) # Bytes, /upload answers with an error as soon as a request body goes past it
+app.config['UPLOAD_TTL'] = float(os.environ.get('UPLOAD_TTL', 0)) # Seconds before the sweeper deletes an upload, 0 keeps uploads forever
+app.config['UPLOAD_SWEEP_INTERVAL'] = 300 # Seconds between sweeps
+app.config['UPLOAD_SWEEP_BATCH'] = 500 # Files the sweeper deletes before pausing, so a big backlog doesn't hog the disk
+app.config['UPLOAD_DB_PATH'] = os.environ.get('UPLOAD_DB_PATH', './uploads.db') # When each lab uploaded each of its files, what the sweeper goes by
+app.config['UPLOAD_INDEX_FOLDERS'] = 64 # Labs whose upload listing is kept in memory
+app.config['UPLOADS_PAGE_SIZE'] = 50 # Rows per page of /uploads
+app.config['CATALOG_PREVIEW_ROWS'] = 1000 # Rows shown after an import, the rest are only counted
+app.config['CATALOG_IMPORT_WORKERS'] = 2 # Background import threads per process
+app.config['CATALOG_IMPORT_MAX_PENDING'] = 8 # Queued + running imports before new ones are refused
+app.config['CATALOG_JOB_TTL'] = 3600 # Seconds a finished import job can still be polled
+app.config['CATALOG_SPOOL_FOLDER'] = os.path.join(tempfile.gettempdir(), 'trendy-tees-imports')
+app.config['CATALOG_SPOOL_MEMORY'] = 512 * 1024 # Bytes of a streamed import's upload copy kept in memory before it goes to a temp file
+app.config['CATALOG_DB_PATH'] = './catalog.db' # Imported products live here between requests
+app.config['CATALOG_INSERT_BATCH'] = 5000 # Products per insert transaction during an import
+app.config['CATALOG_PAGE_SIZE'] = 50 # Default /catalog page size, capped at CATALOG_MAX_PAGE_SIZE
+app.config['CATALOG_MAX_PAGE_SIZE'] = 1000
+app.config['USER_STORE'] = os.environ.get('USER_STORE', 'memory') # 'memory' (this process only) or 'sqlite' (shared by workers)
+app.config['USER_DB_PATH'] = os.environ.get('USER_DB_PATH', './users.db')
+app.config['USER_PAGE_SIZE'] = 100 # Default page size for /admin/users and paginated /api/user-data
+app.config['USER_MAX_PAGE_SIZE'] = 1000
+app.config['TENANT_MODE'] = os.environ.get('TENANT_MODE') # 'subdomain' or 'header' hosts many isolated labs in one process, unset for a single store
+app.config['TENANT_HEADER'] = 'X-Tenant' # Names the tenant when TENANT_MODE is 'header'
+app.config['TENANT_BASE_DOMAIN'] = os.environ.get('TENANT_BASE_DOMAIN') # alice.<base domain> is tenant alice, unset takes the first label of hosts with 3+ labels
+app.config['TENANT_MAX_ACTIVE'] = 1000 # Tenants kept loaded, the least recently used are dropped first
+app.config['TENANT_IDLE_TTL'] = 3600 # Seconds without a request before a tenant is dropped
+app.config['SNAPSHOT_FOLDER'] = os.environ.get('SNAPSHOT_FOLDER', './snapshots') # Lab snapshots, keep it on the upload folder's filesystem so files are hardlinked
+app.config['SUPPLIER_CONNECT_TIMEOUT'] = 3.0 # Seconds to establish a connection to a supplier
+app.config['SUPPLIER_READ_TIMEOUT'] = 10.0 # Seconds to wait on any single read from a supplier
+app.config['SUPPLIER_PREVIEW_CHARS'] = 1000 # Characters shown (and roughly read) from a supplier page
+app.config['SUPPLIER_POOL_SIZE'] = 4 # Idle keep-alive connections kept per supplier host
+app.config['SUPPLIER_CACHE_SIZE'] = 256 # Supplier responses kept in memory
+app.config['SUPPLIER_CACHE_TTL'] = 60 # Seconds a cached supplier response is reused
+app.config['SUPPLIER_BATCH_CONCURRENCY'] = 16 # Supplier checks running at once across all batches in a process
+app.config['SUPPLIER_BATCH_PER_HOST'] = 4 # Supplier checks running at once against any single host
+app.config['SUPPLIER_BATCH_DEADLINE'] = 15.0 # Seconds from the start of a batch entry's check before it is reported as timed out
+app.config['SUPPLIER_BATCH_MAX_URLS'] = 1000
+app.config['SSTI_TEMPLATE_CACHE_SIZE'] = 512 # Compiled /ssti preview templates kept in memory
+app.config['COMMAND_CACHE_TTL'] = 60 # Seconds a /command output is reused before the command runs again
+app.config['COMPRESS'] = os.environ.get('COMPRESS', '1') != '0' # gzip (and brotli, if installed) per Accept-Encoding
+app.config['COMPRESS_MIN_SIZE'] = 1024 # Smaller buffered responses go out as they are, streamed ones are always compressed
+app.config['COMPRESS_GZIP_LEVEL'] = 6 # For per-request compression, bodies compressed once up front use 9
+app.config['COMPRESS_BROTLI_QUALITY'] = 5 # Likewise, up-front compression uses 11
+app.config['MINIFY_TEMPLATES'] = os.environ.get('MINIFY_TEMPLATES', '1') != '0' # Strip template indentation and CSS comments at import, 0 keeps them readable for debugging
+app.config['STREAM_PAGES'] = os.environ.get('STREAM_PAGES', '1') != '0' # Slow pages (supplier checks, catalog imports) send their shell before the content
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR') # Shared folder so /metrics can add up every worker process
+app.config['METRICS_FLUSH_INTERVAL'] = 1.0 # Seconds between writes of this process's metrics to METRICS_DIR
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR') # Where request profiles are written, profiling is off when unset
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0)) # Share of requests profiled, 0.01 = 1 in 100
+app.config['PROFILE_HEADER'] = 'X-Profile-Request' # Requests sending PROFILE_TOKEN in this header are always profiled
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN') # The header is ignored when unset
+app.config['PROFILE_SAMPLE_INTERVAL'] = 0.001 # Seconds between stack samples of a profiled request (in practice at least the GIL switch interval)
+app.config['PROFILE_KEEP'] = 50 # Profiles kept per endpoint, oldest are deleted first
+app.config['PROFILE_INDEX_ROWS'] = 10 # Profiles listed per endpoint on /debug/profiles
 HARDCODED_API_KEY = "TT-INTERNAL-API-KEY-ABC123XYZ" # Still hardcoded
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# --- SQLite Storage ---
+
+_db_local = threading.local()
+
+def get_db(path):
+    """Returns this thread's connection to the SQLite database at path.
+
+    Connections are opened once per thread (and again after a fork) in WAL mode,
+    so readers never block the writer and several worker processes can share a file.
+    """
+    if getattr(_db_local, 'pid', None) != os.getpid():
+        _db_local.pid = os.getpid()
+        _db_local.conns = {}
+    conn = _db_local.conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _db_local.conns[path] = conn
+    return conn
+
+# --- Caching Helpers ---
+
+_MISSING = object()
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional TTL and hit/miss/eviction counters."""
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at or None, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl=_MISSING):
+        ttl = self.ttl if ttl is _MISSING else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': round(self.hit_rate, 4),
+        }
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key so only one of them does the work."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
 # --- Simple User Management (with vulnerabilities) ---
 
-# VULNERABILITY: Users stored in memory and passwords in plaintext
-USERS = {
-    # Default admin account
-    'admin': {
+# User records are dicts with password, email, role and created_at. Every route goes
+# through the USERS mapping, so the backend can be swapped without touching them.
+
+class UserStore(MutableMapping):
+    """Mapping of username -> user record, plus keyset pagination in username order."""
+
+    @abc.abstractmethod
+    def page(self, after=None, limit=100):
+        """Returns up to limit (username, user) pairs with usernames sorted after the cursor."""
+
+    def iter_pages(self, batch_size=1000):
+        """Yields every user as successive pages, without holding more than one page at a time."""
+        after = None
+        while True:
+            page = self.page(after=after, limit=batch_size)
+            if page:
+                yield page
+            if len(page) < batch_size:
+                return
+            after = page[-1][0]
+
+    def replace_all(self, users):
+        """Replaces every user with the given (username, user) pairs."""
+        self.clear()
+        for username, user in users:
+            self[username] = user
+
+class MemoryUserStore(UserStore):
+    """Users kept in a dict, private to the current process."""
+
+    def __init__(self):
+        self._users = {}
+        # Sorted usernames for paging, built on first use and then kept up to date. Writes and
+        # the build hold the lock, so a page never sees a username the list missed
+        self._sorted = None
+        self._lock = threading.Lock()
+
+    def __getitem__(self, username):
+        return self._users[username]
+
+    def __setitem__(self, username, user):
+        with self._lock:
+            if self._sorted is not None and username not in self._users:
+                bisect.insort(self._sorted, username)
+            self._users[username] = user
+
+    def __delitem__(self, username):
+        with self._lock:
+            del self._users[username]
+            if self._sorted is not None:
+                del self._sorted[bisect.bisect_left(self._sorted, username)]
+
+    def __iter__(self):
+        return iter(self._users)
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, username):
+        return username in self._users
+
+    def create_user(self, username, user):
+        """Adds a user unless the name is taken. Returns True if it was added."""
+        with self._lock:
+            if self._users.setdefault(username, user) is not user:
+                return False
+            if self._sorted is not None:
+                bisect.insort(self._sorted, username)
+            return True
+
+    def replace_all(self, users):
+        # Swapped in whole, so requests never see a half restored store
+        users = dict(users)
+        with self._lock:
+            self._users = users
+            self._sorted = None
+
+    def page(self, after=None, limit=100):
+        with self._lock:
+            if self._sorted is None:
+                self._sorted = sorted(self._users)
+            start = 0 if after is None else bisect.bisect_right(self._sorted, after)
+            return [(username, self._users[username]) for username in self._sorted[start:start + limit]]
+
+class SQLiteUserStore(UserStore):
+    """Users kept in a WAL-mode SQLite file, shared by every worker process that opens it."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        username TEXT PRIMARY KEY,
+        password TEXT NOT NULL,
+        email TEXT NOT NULL,
+        role TEXT NOT NULL,
+        created_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    """
+    COLUMNS = 'password, email, role, created_at'
+
+    def __init__(self, path, table='users'):
+        self.path = path
+        self.table = table
+        self.db().executescript(self.SCHEMA.format(table=table))
+
+    def db(self):
+        # Pooled per thread (and per process) by get_db
+        return get_db(self.path)
+
+    @staticmethod
+    def _row_to_user(row):
+        return {'password': row[0], 'email': row[1], 'role': row[2], 'created_at': row[3]}
+
+    @staticmethod
+    def _user_to_row(username, user):
+        return (username, user['password'], user['email'], user.get('role', 'user'), user.get('created_at', time.time()))
+
+    def __getitem__(self, username):
+        row = self.db().execute(f'SELECT {self.COLUMNS} FROM {self.table} WHERE username = ?', (username,)).fetchone()
+        if row is None:
+            raise KeyError(username)
+        return self._row_to_user(row)
+
+    def __setitem__(self, username, user):
+        self.db().execute(f'INSERT OR REPLACE INTO {self.table} (username, {self.COLUMNS}) VALUES (?, ?, ?, ?, ?)',
+                          self._user_to_row(username, user))
+
+    def __delitem__(self, username):
+        if self.db().execute(f'DELETE FROM {self.table} WHERE username = ?', (username,)).rowcount == 0:
+            raise KeyError(username)
+
+    def __iter__(self):
+        for (username,) in self.db().execute(f'SELECT username FROM {self.table} ORDER BY username'):
+            yield username
+
+    def __len__(self):
+        return self.db().execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def __contains__(self, username):
+        return self.db().execute(f'SELECT 1 FROM {self.table} WHERE username = ?', (username,)).fetchone() is not None
+
+    def items(self):
+        for row in self.db().execute(f'SELECT username, {self.COLUMNS} FROM {self.table} ORDER BY username'):
+            yield row[0], self._row_to_user(row[1:])
+
+    def page(self, after=None, limit=100):
+        if after is None:
+            rows = self.db().execute(f'SELECT username, {self.COLUMNS} FROM {self.table} ORDER BY username LIMIT ?', (limit,))
+        else:
+            rows = self.db().execute(f'SELECT username, {self.COLUMNS} FROM {self.table} WHERE username > ? ORDER BY username LIMIT ?',
+                                     (after, limit))
+        return [(row[0], self._row_to_user(row[1:])) for row in rows]
+
+    def create_user(self, username, user):
+        """Adds a user unless the name is taken, atomically across processes. Returns True if it was added."""
+        cursor = self.db().execute(f'INSERT OR IGNORE INTO {self.table} (username, {self.COLUMNS}) VALUES (?, ?, ?, ?, ?)',
+                                   self._user_to_row(username, user))
+        return cursor.rowcount == 1
+
+    def replace_all(self, users):
+        db = self.db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(f'DELETE FROM {self.table}')
+            db.executemany(f'INSERT INTO {self.table} (username, {self.COLUMNS}) VALUES (?, ?, ?, ?, ?)',
+                           (self._user_to_row(username, user) for username, user in users))
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+def make_user_store(kind=None, table='users'):
+    """Builds the user store named by USER_STORE."""
+    kind = kind or app.config['USER_STORE']
+    if kind == 'memory':
+        return MemoryUserStore()
+    if kind == 'sqlite':
+        return SQLiteUserStore(app.config['USER_DB_PATH'], table=table)
+    raise ValueError(f"Unknown USER_STORE '{kind}', expected 'memory' or 'sqlite'")
+
+def seed_users(users):
+    """Adds the default admin account, only if it isn't there already (shared stores outlive the process)."""
+    users.create_user('admin', {
         'password': 'admin123',  # VULNERABILITY: Weak default password
         'email': 'admin@trendytees.com',
         'role': 'admin',
         'created_at': time.time(),
-    }
-}
+    })
+
+# VULNERABILITY: Passwords stored in plaintext (and in memory unless USER_STORE=sqlite)
+DEFAULT_USERS = make_user_store()
+seed_users(DEFAULT_USERS)
+
+# --- Tenants ---
+# With TENANT_MODE set one process hosts many isolated labs. The tenant comes from the
+# subdomain or a header, and brings its own users, upload folder and session secret.
+
+TENANT_NAME_RE = re.compile(r'^[a-z0-9][a-z0-9-]{0,62}$')
+
+class Tenant:
+    """State of one lab instance, built on its first request and dropped again when idle."""
+
+    def __init__(self, name):
+        self.name = name
+        self.upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], 'tenants', name)
+        os.makedirs(self.upload_folder, exist_ok=True)
+        # Derived instead of stored, so sessions survive eviction and every worker agrees on it
+        self.secret_key = hmac.new(app.config['SECRET_KEY'].encode(), name.encode(), hashlib.sha256).hexdigest()
+        self.users = make_user_store(table='users_' + name.replace('-', '_'))
+        self.catalog_table = 'products_' + name.replace('-', '_')
+        seed_users(self.users)
+        self.session_serializer = None
+        self.last_seen = time.monotonic()
+
+class TenantRegistry:
+    """Live tenants in least recently used order.
+
+    Tenants idle for longer than idle_ttl, or beyond max_active, are dropped. An
+    evicted tenant comes back on its next request with the same secret and
+    upload folder. Its users come back too with USER_STORE=sqlite, but a memory
+    store starts over.
+    """
+
+    def __init__(self, max_active, idle_ttl):
+        self.max_active = max_active
+        self.idle_ttl = idle_ttl
+        self.created = 0
+        self.evicted = 0
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        # The name ends up in a table name and in paths, only ones get_tenant_name() would accept are let through
+        if not TENANT_NAME_RE.match(name):
+            raise ValueError(f"Invalid tenant name '{name}'")
+        now = time.monotonic()
+        with self._lock:
+            tenant = self._tenants.get(name)
+            if tenant is not None:
+                self._tenants.move_to_end(name)
+                tenant.last_seen = now
+                return tenant
+        # Built outside the lock since it touches the disk, the first one stored wins
+        tenant = Tenant(name)
+        with self._lock:
+            if name not in self._tenants:
+                self._tenants[name] = tenant
+                self.created += 1
+            tenant = self._tenants[name]
+            self._tenants.move_to_end(name)
+            tenant.last_seen = now
+            self._evict(now)
+        return tenant
+
+    def _evict(self, now):
+        while self._tenants:
+            name, oldest = next(iter(self._tenants.items()))
+            if len(self._tenants) <= self.max_active and now - oldest.last_seen < self.idle_ttl:
+                break
+            del self._tenants[name]
+            self.evicted += 1
+
+    def stats(self):
+        with self._lock:
+            return {'active': len(self._tenants), 'created': self.created, 'evicted': self.evicted}
+
+_tenant_registry = None
+
+def get_tenant_registry():
+    global _tenant_registry
+    if _tenant_registry is None:
+        _tenant_registry = TenantRegistry(app.config['TENANT_MAX_ACTIVE'], app.config['TENANT_IDLE_TTL'])
+    return _tenant_registry
+
+def get_tenant_name():
+    """Returns the tenant named by the current request, or None if it names no valid one."""
+    if app.config['TENANT_MODE'] == 'header':
+        name = request.headers.get(app.config['TENANT_HEADER'], '')
+    else:
+        host = request.host.partition(':')[0].lower()
+        base = app.config['TENANT_BASE_DOMAIN']
+        if base:
+            name = host[:-len(base) - 1] if host.endswith('.' + base) else ''
+        else:
+            name = host.split('.', 1)[0] if host.count('.') >= 2 else ''
+    name = name.lower()
+    return name if TENANT_NAME_RE.match(name) else None
+
+def get_tenant():
+    """Returns the current request's Tenant, or None outside tenant mode (or of a request naming none)."""
+    if not app.config['TENANT_MODE'] or not has_request_context():
+        return None
+    if 'tenant' not in g:
+        name = get_tenant_name()
+        g.tenant = get_tenant_registry().get(name) if name else None
+    return g.tenant
+
+def get_users():
+    tenant = get_tenant()
+    return DEFAULT_USERS if tenant is None else tenant.users
+
+def get_upload_folder():
+    tenant = get_tenant()
+    return app.config['UPLOAD_FOLDER'] if tenant is None else tenant.upload_folder
+
+# The current tenant's users in tenant mode, DEFAULT_USERS otherwise
+USERS = LocalProxy(get_users)
+
+class TenantSessionInterface(SecureCookieSessionInterface):
+    """Signs session cookies with the tenant's own secret, so labs can't read or forge each other's."""
+
+    def get_signing_serializer(self, app):
+        if not app.config['TENANT_MODE']:
+            return super().get_signing_serializer(app)
+        tenant = get_tenant()
+        if tenant is None:
+            return None  # Null session, require_tenant turns the request away
+        if tenant.session_serializer is None:
+            tenant.session_serializer = URLSafeTimedSerializer(
+                tenant.secret_key,
+                salt=self.salt,
+                serializer=self.serializer,
+                signer_kwargs={'key_derivation': self.key_derivation, 'digest_method': self.digest_method},
+            )
+        return tenant.session_serializer
+
+app.session_interface = TenantSessionInterface()
 
 # VULNERABILITY: No password complexity requirements
 def is_valid_password(password):
@@ -55,6 +582,587 @@ def generate_session_token():
     # VULNERABILITY: Predictable session token pattern
     return 'session_' + str(int(time.time())) + str(random.randint(1000, 9999))
 
+# --- Request Helpers ---
+
+def wants_json():
+    """True when the client asked for JSON rather than an HTML page."""
+    return request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json'
+
+def get_page_args(default_limit, max_limit):
+    """Returns the (after, limit) keyset pagination arguments of the current request."""
+    after = request.args.get('after') or None
+    try:
+        limit = int(request.args.get('limit', default_limit))
+    except ValueError:
+        limit = default_limit
+    return after, max(1, min(limit, max_limit))
+
+# --- Request Metrics ---
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class MetricsShard:
+    """Request counts of one thread, only ever written by that thread, so recording takes no lock."""
+
+    def __init__(self, buckets, thread=None):
+        self.buckets = buckets
+        self.thread = thread
+        self.requests = {}        # (endpoint, method, status) -> count
+        self.latency = {}         # endpoint -> per-bucket counts, last slot is +Inf
+        self.latency_sum = {}     # endpoint -> total seconds
+        self.request_bytes = {}   # endpoint -> bytes received
+        self.response_bytes = {}  # endpoint -> bytes sent
+        self.in_flight = {}       # endpoint -> requests currently being handled
+
+    def add(self, other):
+        """Adds other's counts to this shard. Other's dicts are copied first, copies happen under the GIL."""
+        for key, count in other.requests.copy().items():
+            self.requests[key] = self.requests.get(key, 0) + count
+        for endpoint, counts in other.latency.copy().items():
+            total = self.latency.get(endpoint)
+            if total is None:
+                total = self.latency[endpoint] = [0] * (len(self.buckets) + 1)
+            for i, count in enumerate(counts.copy()):
+                total[i] += count
+        for name in ('latency_sum', 'request_bytes', 'response_bytes', 'in_flight'):
+            target = getattr(self, name)
+            for endpoint, value in getattr(other, name).copy().items():
+                target[endpoint] = target.get(endpoint, 0) + value
+
+class RequestMetrics:
+    """Per-process request counters, latency histograms and in-flight gauges.
+
+    Every request thread records into its own MetricsShard, a bisect and a few dict updates
+    without a lock; snapshot() adds the shards up. With METRICS_DIR set each process also
+    dumps a snapshot there now and then, and /metrics adds them all up. The counters of
+    workers that exited are folded into METRICS_RETIRED_FILE, so the totals never go down.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards = []  # Shards of live threads
+        self._retired = MetricsShard(buckets)  # Counts of threads that are gone
+        self._lock = threading.Lock()  # Guards the shard list, not the counts
+        self._next_flush = 0.0
+        self._closed = False
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = MetricsShard(self.buckets, threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def started(self, endpoint):
+        in_flight = self._shard().in_flight
+        in_flight[endpoint] = in_flight.get(endpoint, 0) + 1
+
+    def finished(self, endpoint, method, status, seconds, request_bytes, response_bytes):
+        shard = self._shard()
+        shard.in_flight[endpoint] -= 1
+        key = (endpoint, method, status)
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        counts = shard.latency.get(endpoint)
+        if counts is None:
+            counts = shard.latency[endpoint] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        shard.latency_sum[endpoint] = shard.latency_sum.get(endpoint, 0.0) + seconds
+        shard.request_bytes[endpoint] = shard.request_bytes.get(endpoint, 0) + request_bytes
+        shard.response_bytes[endpoint] = shard.response_bytes.get(endpoint, 0) + response_bytes
+
+    def snapshot(self):
+        """Returns a JSON-friendly copy of everything recorded so far."""
+        total = MetricsShard(self.buckets)
+        with self._lock:
+            # Threads that ended (a server that starts one per request) are merged for good
+            for shard in [shard for shard in self._shards if not shard.thread.is_alive()]:
+                self._retired.add(shard)
+                self._shards.remove(shard)
+            total.add(self._retired)
+            for shard in self._shards:
+                total.add(shard)
+        return {
+            'pid': os.getpid(),
+            'requests': [[*key, count] for key, count in total.requests.items()],
+            'latency': total.latency,
+            'latency_sum': total.latency_sum,
+            'request_bytes': total.request_bytes,
+            'response_bytes': total.response_bytes,
+            'in_flight': total.in_flight,
+            'caches': {name: get_cache().stats() for name, get_cache in METRICS_CACHES.items()},
+            'counters': {name: get_value() for name, (_help, get_value) in METRICS_COUNTERS.items()},
+        }
+
+    def snapshot_path(self, metrics_dir):
+        return os.path.join(metrics_dir, f'metrics-{os.getpid()}.json')
+
+    def maybe_flush(self, force=False):
+        """Writes this process's snapshot to METRICS_DIR, at most once per flush interval."""
+        metrics_dir = app.config['METRICS_DIR']
+        if not metrics_dir or self._closed:
+            return
+        now = time.monotonic()
+        if not force and now < self._next_flush:
+            return
+        self._next_flush = now + app.config['METRICS_FLUSH_INTERVAL']
+        try:
+            os.makedirs(metrics_dir, exist_ok=True)
+            path = self.snapshot_path(metrics_dir)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Metrics flush error: {e}") # Log real error
+
+    def retire(self):
+        """Folds this process's counts into METRICS_RETIRED_FILE for good, for a worker that is exiting."""
+        metrics_dir = app.config['METRICS_DIR']
+        if not metrics_dir:
+            return
+        self._closed = True  # No flush may bring the snapshot back once it's folded
+        try:
+            with metrics_dir_lock(metrics_dir, fcntl.LOCK_EX):
+                retire_metrics_snapshot(metrics_dir, self.snapshot_path(metrics_dir), self.snapshot())
+        except OSError as e:
+            print(f"Metrics retire error: {e}") # Log real error
+
+# Summed counters of every worker that exited, kept so the exported totals never drop
+METRICS_RETIRED_FILE = 'metrics-retired.json'
+
+@contextlib.contextmanager
+def metrics_dir_lock(metrics_dir, operation):
+    """Readers of METRICS_DIR hold it shared, folding a snapshot into the retired one holds it exclusively."""
+    with open(os.path.join(metrics_dir, '.lock'), 'a') as lock:
+        fcntl.flock(lock, operation)
+        yield
+
+def retire_metrics_snapshot(metrics_dir, path, snap=None):
+    """Adds the counters of a gone process's snapshot (read from path unless given) to the retired one, then deletes path.
+
+    Gauges (requests in flight, cache sizes) are dropped. Callers hold the exclusive
+    metrics_dir_lock, so readers see the counts either in path or in the retired file.
+    """
+    if snap is None:
+        try:
+            with open(path) as f:
+                snap = json.load(f)
+        except FileNotFoundError:
+            return  # Folded by another process already
+        except ValueError:
+            snap = None  # A .tmp the process died writing, nothing in it to keep
+    if snap is not None:
+        retired_path = os.path.join(metrics_dir, METRICS_RETIRED_FILE)
+        try:
+            with open(retired_path) as f:
+                retired = json.load(f)
+        except FileNotFoundError:
+            retired = {'pid': None, 'requests': [], 'latency': {}, 'latency_sum': {}, 'request_bytes': {},
+                       'response_bytes': {}, 'in_flight': {}, 'caches': {}, 'counters': {}}
+        requests = {tuple(row[:3]): row[3] for row in retired['requests']}
+        for *key, count in snap['requests']:
+            requests[tuple(key)] = requests.get(tuple(key), 0) + count
+        retired['requests'] = [[*key, count] for key, count in requests.items()]
+        for endpoint, counts in snap['latency'].items():
+            total = retired['latency'].setdefault(endpoint, [0] * len(counts))
+            for i, count in enumerate(counts):
+                total[i] += count
+        for name in ('latency_sum', 'request_bytes', 'response_bytes', 'counters'):
+            for key, value in snap.get(name, {}).items():
+                retired[name][key] = retired[name].get(key, 0) + value
+        for name, stats in snap.get('caches', {}).items():
+            total = retired['caches'].setdefault(name, {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0})
+            for stat in ('hits', 'misses', 'evictions'):
+                total[stat] += stats.get(stat, 0)
+        with open(retired_path + '.tmp', 'w') as f:
+            json.dump(retired, f)
+        os.replace(retired_path + '.tmp', retired_path)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def collect_metrics():
+    """Returns the snapshots to export: every worker's from METRICS_DIR, or just this process's."""
+    metrics_dir = app.config['METRICS_DIR']
+    if not metrics_dir:
+        return [REQUEST_METRICS.snapshot()]
+    REQUEST_METRICS.maybe_flush(force=True)
+    # Snapshots (or half written .tmp files) of workers that were killed instead of exiting
+    gone = []
+    for entry in os.scandir(metrics_dir):
+        pid = entry.name[len('metrics-'):].split('.', 1)[0]
+        if entry.name.startswith('metrics-') and pid.isdigit() and not process_alive(int(pid)):
+            gone.append(entry.path)
+    if gone:
+        with metrics_dir_lock(metrics_dir, fcntl.LOCK_EX):
+            for path in gone:
+                retire_metrics_snapshot(metrics_dir, path)
+    snapshots = []
+    with metrics_dir_lock(metrics_dir, fcntl.LOCK_SH):
+        for entry in os.scandir(metrics_dir):
+            if entry.name.startswith('metrics-') and entry.name.endswith('.json'):
+                try:
+                    with open(entry.path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # Being replaced right now
+    return snapshots
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render_prometheus(snapshots, buckets=LATENCY_BUCKETS):
+    """Adds up the snapshots and renders them in the Prometheus text exposition format."""
+    requests, latency, latency_sum, request_bytes, response_bytes, in_flight, caches, counters = {}, {}, {}, {}, {}, {}, {}, {}
+    for snap in snapshots:
+        for endpoint, method, status, count in snap['requests']:
+            key = (endpoint, method, status)
+            requests[key] = requests.get(key, 0) + count
+        for endpoint, counts in snap['latency'].items():
+            total = latency.setdefault(endpoint, [0] * (len(buckets) + 1))
+            for i, count in enumerate(counts):
+                total[i] += count
+        for source, target in ((snap['latency_sum'], latency_sum), (snap['request_bytes'], request_bytes),
+                               (snap['response_bytes'], response_bytes)):
+            for endpoint, value in source.items():
+                target[endpoint] = target.get(endpoint, 0) + value
+        for endpoint, value in snap['in_flight'].items():
+            in_flight[endpoint] = in_flight.get(endpoint, 0) + value
+        for name, value in snap.get('counters', {}).items():
+            counters[name] = counters.get(name, 0) + value
+        for name, stats in snap.get('caches', {}).items():
+            total = caches.setdefault(name, {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0})
+            for stat in ('hits', 'misses', 'evictions', 'size'):
+                total[stat] += stats.get(stat, 0)
+
+    lines = [
+        '# HELP trendytees_http_requests_total Requests handled, by endpoint, method and status code.',
+        '# TYPE trendytees_http_requests_total counter',
+    ]
+    for (endpoint, method, status), count in sorted(requests.items()):
+        lines.append(f'trendytees_http_requests_total{{endpoint="{_label(endpoint)}",method="{method}",status="{status}"}} {count}')
+
+    lines += [
+        '# HELP trendytees_http_request_duration_seconds Time from request start until the response is handed to the server.',
+        '# TYPE trendytees_http_request_duration_seconds histogram',
+    ]
+    for endpoint, counts in sorted(latency.items()):
+        label = _label(endpoint)
+        cumulative = 0
+        for bound, count in zip((*buckets, '+Inf'), counts):
+            cumulative += count
+            lines.append(f'trendytees_http_request_duration_seconds_bucket{{endpoint="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'trendytees_http_request_duration_seconds_sum{{endpoint="{label}"}} {latency_sum.get(endpoint, 0.0)}')
+        lines.append(f'trendytees_http_request_duration_seconds_count{{endpoint="{label}"}} {cumulative}')
+
+    for name, help_text, values in (
+            ('trendytees_http_request_bytes_total', 'Request body bytes received.', request_bytes),
+            ('trendytees_http_response_bytes_total', 'Response body bytes sent, where the length is known up front.', response_bytes)):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        lines += [f'{name}{{endpoint="{_label(endpoint)}"}} {value}' for endpoint, value in sorted(values.items())]
+
+    lines += [
+        '# HELP trendytees_http_requests_in_flight Requests currently being handled by live workers.',
+        '# TYPE trendytees_http_requests_in_flight gauge',
+    ]
+    lines += [f'trendytees_http_requests_in_flight{{endpoint="{_label(endpoint)}"}} {value}' for endpoint, value in sorted(in_flight.items())]
+
+    for stat, metric_type in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'), ('size', 'gauge')):
+        name = f'trendytees_cache_{stat}' + ('_total' if metric_type == 'counter' else '')
+        lines += [f'# HELP {name} In-memory cache {stat}, by cache.', f'# TYPE {name} {metric_type}']
+        lines += [f'{name}{{cache="{_label(cache)}"}} {stats[stat]}' for cache, stats in sorted(caches.items())]
+
+    for name, value in sorted(counters.items()):
+        help_text = METRICS_COUNTERS[name][0] if name in METRICS_COUNTERS else name
+        lines += [f'# HELP trendytees_{name}_total {help_text}', f'# TYPE trendytees_{name}_total counter',
+                  f'trendytees_{name}_total {value}']
+    return '\n'.join(lines) + '\n'
+
+REQUEST_METRICS = RequestMetrics()
+
+# Caches reported by /metrics and the debug page, name -> function returning the LRUCache
+METRICS_CACHES = {
+    'ssti_templates': lambda: get_template_cache(),
+    'supplier_responses': lambda: get_supplier_fetcher().cache,
+    'command_results': lambda: get_command_runner().cache,
+    'lfi_files': lambda: get_lfi_file_cache(),
+    'upload_indexes': lambda: get_upload_indexes(),
+}
+
+# Plain counters reported by /metrics as trendytees_<name>_total, name -> (help, function returning the count)
+METRICS_COUNTERS = {
+    'command_spawns': ('Processes spawned by /command.', lambda: get_command_runner().spawns),
+    'command_spawns_avoided': ('/command runs answered from the cache or by joining a spawn in progress.',
+                               lambda: get_command_runner().spawns_avoided),
+    'upload_objects_stored': ('Uploads whose content was new and stored as an object.', lambda: get_upload_store().stored),
+    'upload_objects_deduplicated': ('Uploads linked to an object that was already stored.',
+                                    lambda: get_upload_store().deduplicated),
+    'uploads_swept': ('Uploads the sweeper deleted for being older than UPLOAD_TTL.',
+                      lambda: _upload_sweeper.uploads_deleted if _upload_sweeper else 0),
+    'upload_objects_swept': ('Stored objects the sweeper deleted once no upload linked to them.',
+                             lambda: _upload_sweeper.objects_deleted if _upload_sweeper else 0),
+}
+
+# The hooks keep their state in one g entry and resolve g and request once each, every
+# access through the context proxies costs about as much as recording the request itself
+
+@app.before_request
+def start_request_metrics():
+    endpoint = request._get_current_object().endpoint or 'unmatched'
+    g._get_current_object().metrics = (endpoint, time.perf_counter())
+    REQUEST_METRICS.started(endpoint)
+
+@app.after_request
+def record_request_metrics(response):
+    # Registered before every other after_request hook, so it runs last and sees the final response
+    state = g._get_current_object().pop('metrics', None)  # Taken, so teardown knows it's recorded
+    if state is None:
+        return response
+    # calculate_content_length() would buffer a streamed body, those only count a Content-Length they set
+    response_bytes = response.content_length
+    if response_bytes is None:
+        response_bytes = (None if response.is_streamed else response.calculate_content_length()) or 0
+    req = request._get_current_object()
+    REQUEST_METRICS.finished(state[0], req.method, response.status_code,
+                             time.perf_counter() - state[1], req.content_length or 0, response_bytes)
+    REQUEST_METRICS.maybe_flush()
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    # after_request doesn't run when a view raises, count those as 500s here
+    state = g._get_current_object().pop('metrics', None)
+    if state is not None:
+        req = request._get_current_object()
+        REQUEST_METRICS.finished(state[0], req.method, 500, time.perf_counter() - state[1], req.content_length or 0, 0)
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_prometheus(collect_metrics()), mimetype='text/plain; version=0.0.4')
+
+# --- Request Profiling ---
+
+class StackSampler:
+    """Samples the Python stacks of registered threads into collapsed-stack counts.
+
+    A single daemon thread per process wakes up every `interval` seconds while at
+    least one thread is registered, and sleeps on a condition otherwise.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.pid = os.getpid()
+        self._targets = {}  # thread id -> {collapsed stack: samples}
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def start(self, thread_id):
+        with self._cond:
+            self._targets[thread_id] = {}
+            self._cond.notify()
+
+    def stop(self, thread_id):
+        with self._cond:
+            return self._targets.pop(thread_id, {})
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._targets:
+                    self._cond.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._cond:
+                for thread_id, counts in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stack = collapse_stack(frame)
+                        counts[stack] = counts.get(stack, 0) + 1
+
+def collapse_stack(frame):
+    """Returns 'outer;...;inner' for a frame, in the format flamegraph.pl and speedscope read."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':'))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+_stack_sampler = None
+
+def get_stack_sampler():
+    global _stack_sampler
+    if _stack_sampler is None or _stack_sampler.pid != os.getpid():
+        _stack_sampler = StackSampler(app.config['PROFILE_SAMPLE_INTERVAL'])
+    return _stack_sampler
+
+def should_profile():
+    """Profiles a PROFILE_SAMPLE_RATE share of requests, plus any carrying the trusted header."""
+    if not app.config['PROFILE_DIR']:
+        return False
+    token = app.config['PROFILE_TOKEN']
+    sent = request.headers.get(app.config['PROFILE_HEADER'])
+    if token and sent and hmac.compare_digest(sent.encode(), token.encode()):
+        return True
+    return random.random() < app.config['PROFILE_SAMPLE_RATE']
+
+def save_profile(endpoint, profiler, stacks, seconds):
+    """Writes <endpoint>/<name>.pstats and .collapsed under PROFILE_DIR and prunes old ones."""
+    folder = os.path.join(app.config['PROFILE_DIR'], secure_filename(endpoint) or 'unmatched')
+    os.makedirs(folder, exist_ok=True)
+    # Names sort by time, and carry the duration so the index doesn't have to open them
+    name = f'{time.time():.6f}-{os.getpid()}-{seconds * 1000:.1f}ms'
+    profiler.dump_stats(os.path.join(folder, name + '.pstats'))
+    with open(os.path.join(folder, name + '.collapsed'), 'w') as f:
+        f.writelines(f'{stack} {count}\n' for stack, count in sorted(stacks.items()))
+    profiles = sorted(entry.name[:-len('.pstats')] for entry in os.scandir(folder) if entry.name.endswith('.pstats'))
+    for old in profiles[:-app.config['PROFILE_KEEP']]:
+        for suffix in ('.pstats', '.collapsed'):
+            try:
+                os.remove(os.path.join(folder, old + suffix))
+            except FileNotFoundError:
+                pass  # Another worker pruned it first
+
+@app.before_request
+def start_request_profile():
+    if not should_profile():
+        return
+    g.profile_start = time.perf_counter()
+    g.profile_thread = threading.get_ident()
+    get_stack_sampler().start(g.profile_thread)
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+@app.teardown_request
+def finish_request_profile(error=None):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    profiler.disable()
+    seconds = time.perf_counter() - g.profile_start
+    stacks = get_stack_sampler().stop(g.profile_thread)
+    try:
+        save_profile(request.endpoint or 'unmatched', profiler, stacks, seconds)
+    except OSError as e:
+        print(f"Profile write error: {e}") # Log real error
+
+def list_profiles(per_endpoint):
+    """Returns {endpoint: [(name, started, milliseconds), ...]}, newest first."""
+    root = app.config['PROFILE_DIR']
+    if not root or not os.path.isdir(root):
+        return {}
+    profiles = {}
+    for folder in sorted(os.scandir(root), key=lambda entry: entry.name):
+        if not folder.is_dir():
+            continue
+        names = sorted((entry.name[:-len('.pstats')] for entry in os.scandir(folder.path)
+                        if entry.name.endswith('.pstats')), reverse=True)[:per_endpoint]
+        rows = []
+        for name in names:
+            started, _pid, duration = name.split('-', 2)
+            rows.append((name, datetime.fromtimestamp(float(started)), duration[:-len('ms')]))
+        profiles[folder.name] = rows
+    return profiles
+
+@app.route('/debug/profiles')
+def debug_profiles():
+    debug_key = request.args.get('key', '')
+    if debug_key != 'debug123':  # VULNERABILITY: Same weak secret as the system info page
+        return render_page("Access Denied", "<p class='flash error'>Invalid debug key</p>")
+
+    profiles = list_profiles(app.config['PROFILE_INDEX_ROWS'])
+    if not app.config['PROFILE_DIR']:
+        body = "<p>Profiling is off. Set PROFILE_DIR to turn it on.</p>"
+    elif not profiles:
+        body = "<p>No profiles recorded yet.</p>"
+    else:
+        sections = []
+        for endpoint, rows in profiles.items():
+            items = ''.join(
+                f'<tr><td>{started:%Y-%m-%d %H:%M:%S}</td><td>{escape(duration)} ms</td>'
+                f'<td><a href="/debug/profiles/{escape(endpoint)}/{escape(name)}.pstats?key={escape(debug_key)}">pstats</a> | '
+                f'<a href="/debug/profiles/{escape(endpoint)}/{escape(name)}.collapsed?key={escape(debug_key)}">collapsed</a></td></tr>'
+                for name, started, duration in rows
+            )
+            sections.append(f'<h4>{escape(endpoint)}</h4><table><tr><th>Started</th><th>Duration</th><th>Files</th></tr>{items}</table>')
+        body = ''.join(sections)
+
+    info_html = f"""
+    <div class="card">
+        <h3>Recent Request Profiles</h3>
+        <p>Sample rate {app.config['PROFILE_SAMPLE_RATE']}, header <code>{escape(app.config['PROFILE_HEADER'])}</code>.
+        Open .pstats files with <code>python -m pstats</code> or snakeviz, feed .collapsed files to flamegraph.pl or speedscope.</p>
+        {body}
+    </div>
+    """
+    return render_page("Request Profiles", info_html)
+
+@app.route('/debug/profiles/<endpoint>/<filename>')
+def debug_profile_file(endpoint, filename):
+    if request.args.get('key', '') != 'debug123':  # VULNERABILITY: Same weak secret as the system info page
+        return render_page("Access Denied", "<p class='flash error'>Invalid debug key</p>"), 403
+    if not app.config['PROFILE_DIR'] or not filename.endswith(('.pstats', '.collapsed')):
+        return render_page("Not Found", "<p class='flash error'>No such profile.</p>"), 404
+    return send_from_directory(os.path.abspath(app.config['PROFILE_DIR']), f'{endpoint}/{filename}',
+                               mimetype='text/plain' if filename.endswith('.collapsed') else 'application/octet-stream')
+
+# Routes that answer without a tenant, e.g. for scrapers and shared assets
+TENANT_EXEMPT_ENDPOINTS = {'metrics', 'static', 'static_styles'}
+
+@app.before_request
+def require_tenant():
+    # Registered after the metrics and profiling hooks, a response returned here skips the hooks after it
+    if app.config['TENANT_MODE'] and request.endpoint not in TENANT_EXEMPT_ENDPOINTS and get_tenant() is None:
+        return render_page("Unknown Lab", "<p class='flash error'>This lab instance doesn't exist.</p>"), 404
+
+# --- Template Minification ---
+
+# Elements whose whitespace is rendered (or is code), left exactly as written
+MINIFY_PRESERVE_RE = re.compile(r'(<(pre|textarea|script|style)\b.*?</\2\s*>)', re.S | re.I)
+# Whitespace that spans lines renders as a single space at most
+MINIFY_NEWLINE_RE = re.compile(r'\s*\n\s*')
+# ...and as nothing at all next to tags that start or end a block
+MINIFY_BLOCK_TAG = r'</?(?:!doctype|html|head|body|meta|title|link|header|nav|main|footer|div|h[1-6]|p|ul|ol|li|form|table|tr|th|td|br|hr)\b[^>]*>'
+MINIFY_BLOCK_TAG_RE = re.compile(rf'({MINIFY_BLOCK_TAG})\s*\n\s*|\s*\n\s*(?={MINIFY_BLOCK_TAG})', re.I)
+CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+CSS_PUNCTUATION_RE = re.compile(r'\s*([{};,])\s*')
+
+def minify_html(html):
+    """Collapses the indentation of a template into what the browser would render anyway.
+
+    Only whitespace containing a newline is touched, so spacing inside a line (and in
+    attribute values) stays as written, and so does everything inside <pre> and friends.
+    Templates are minified once at import; MINIFY_TEMPLATES off returns them unchanged.
+    """
+    if not app.config['MINIFY_TEMPLATES']:
+        return html
+    parts = MINIFY_PRESERVE_RE.split(html)
+    # split() returns text, preserved element, its tag name, text, ...
+    for i in range(0, len(parts), 3):
+        parts[i] = MINIFY_NEWLINE_RE.sub(' ', MINIFY_BLOCK_TAG_RE.sub(r'\1', parts[i]))
+    return ''.join(parts[i] for i in range(len(parts)) if i % 3 != 2)
+
+def minify_css(css):
+    """Strips comments and indentation from a stylesheet, honouring MINIFY_TEMPLATES like minify_html."""
+    if not app.config['MINIFY_TEMPLATES']:
+        return css
+    css = CSS_COMMENT_RE.sub('', css)
+    css = re.sub(r'\s+', ' ', css)
+    return CSS_PUNCTUATION_RE.sub(r'\1', css).replace(';}', '}').strip()
+
 # --- UI Templates ---
 
 def get_user_nav():
@@ -72,64 +1180,47 @@ def get_user_nav():
 
 def render_page(title, content, current_page=None):
     """Helper function to wrap content in a basic Ecommerce HTML structure."""
+    title = escape(title)
+    # The shell pieces are built once at startup, only the per-request bits are joined in
+    return ''.join((
+        PAGE_SHELL_HEAD, title, PAGE_SHELL_NAV,
+        NAV_HTML.get(current_page, NAV_HTML[None]), PAGE_SHELL_NAV_SEP, get_user_nav(),
+        PAGE_SHELL_MAIN, title, PAGE_SHELL_CONTENT, content, PAGE_SHELL_FOOT,
+    ))
 
-    # Navigation links - make them sound standard
-    nav_links = {
-        'home': '/',
-        'designs': '#designs',
-        'upload_design': '/upload',
-        'order_status': '/sql?id=1'
-    }
-    nav_html = ""
-    for name, url in nav_links.items():
-        active_class = 'active' if name == current_page else ''
-        # Make names user-friendly
-        display_name = name.replace("_", " ").title()
-        if name == 'designs': display_name = 'Our Designs'
-        if name == 'upload_design': display_name = 'Upload Your Design'
-        if name == 'order_status': display_name = 'Order Status'
-
-        nav_html += f'<a href="{url}" class="{active_class}">{display_name}</a> '
-
-    user_nav = get_user_nav()
+def page_shell_head(title, current_page=None):
+    """Returns the part of render_page's document that comes before the content, PAGE_SHELL_FOOT follows it."""
+    title = escape(title)
+    return ''.join((
+        PAGE_SHELL_HEAD, title, PAGE_SHELL_NAV,
+        NAV_HTML.get(current_page, NAV_HTML[None]), PAGE_SHELL_NAV_SEP, get_user_nav(),
+        PAGE_SHELL_MAIN, title, PAGE_SHELL_CONTENT,
+    ))
 
-    # Keep the same overall structure but add user navigation
-    return f"""
-    <!doctype html>
-    <html lang="en">
-    <head>
-        <meta charset="utf-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no">
-        <title>{escape(title)} - Trendy Tees</title>
-        {get_styles()}
-    </head>
-    <body>
-        <header class="header">
-             <h1><a href="/">Trendy Tees</a></h1>
-             <nav class="navbar">
-                {nav_html}
-                {user_nav}
-             </nav>
-        </header>
+def iter_page(title, content, current_page=None):
+    """Yields the same document as render_page, the shell first and then content (an iterable of HTML chunks) as it's produced."""
+    yield page_shell_head(title, current_page)
+    yield from content
+    yield PAGE_SHELL_FOOT
 
-        <div class="container">
-            <main class="main-content">
-                <h2>{escape(title)}</h2>
-                {content}
-            </main>
-        </div>
+def stream_response(chunks):
+    """Sends HTML chunks as they're produced, so slow routes get their first bytes out early.
 
-        <footer class="footer">
-            <p>&copy; 2024 Trendy Tees - Custom Apparel</p>
-        </footer>
-    </body>
-    </html>
+    The status and headers go out with the first chunk, so errors further down can only be
+    reported in the page (callers log them too). With STREAM_PAGES off the chunks are joined
+    into one body instead.
     """
+    if not app.config['STREAM_PAGES']:
+        return Response(''.join(chunks))
+    return Response(stream_with_context(chunks))
+
+def stream_page(title, content, current_page=None):
+    """Like render_page, but the page shell is sent before content is computed."""
+    return stream_response(iter_page(title, content, current_page))
 
 def get_styles():
-    """Returns the CSS styles as a string, with enhanced professional UI."""
+    """Returns the CSS stylesheet as a string, with enhanced professional UI."""
     return """
-        <style>
             @import url('https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;500;600;700&display=swap');
             
             :root {
@@ -544,69 +1635,368 @@ def get_styles():
                     gap: 1rem;
                 }
             }
-        </style>
     """
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+# --- Response Compression ---
 
-@app.route('/')
-def index():
-    """Modified homepage to check for session."""
-    # Welcome message based on login status
-    welcome_msg = ""
-    if 'username' in session:
-        welcome_msg = f"<p>Welcome back, <strong>{escape(session['username'])}</strong>! "
-        welcome_msg += "Find the perfect custom t-shirt or browse our collection.</p>"
-    else:
-        welcome_msg = "<p>Welcome to Trendy Tees! Find the perfect custom t-shirt or browse our unique collection.</p>"
-        welcome_msg += "<p><a href='/login' class='btn'>Log In</a> or <a href='/register' class='btn btn-secondary'>Create Account</a></p>"
+try:
+    import brotli  # Optional, adds Content-Encoding: br when installed
+except ImportError:
+    brotli = None
 
-    try:
-        dummy_data = {'wishlist_id': 'wl-abc-789', 'items': ['T001', 'T004']}
-        pickled_data = pickle.dumps(dummy_data)
-        encoded_pickle = base64.urlsafe_b64encode(pickled_data).decode('utf-8')
-    except Exception:
-        encoded_pickle = ""
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'text/xml', 'application/json',
+                          'application/x-ndjson', 'application/javascript', 'image/svg+xml'}
 
-    content = f"""
-    {welcome_msg}
+def available_encodings():
+    # Preferred first, brotli wins ties
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
 
-    <div id="designs" class="content-section">
-        <h3>Shop Our Designs</h3>
-        <div class="product-grid">
-            <div class="product-card">
-                 <img src="data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' width='200' height='150' viewBox='0 0 200 150'%3E%3Crect width='100%25' height='100%25' fill='%23cccccc'/%3E%3Ctext x='50%25' y='50%25' fill='%23ffffff' dominant-baseline='middle' text-anchor='middle' font-size='16px'%3ETee Placeholder%3C/text%3E%3C/svg%3E" alt="T-Shirt Placeholder">
-                <h4>Classic Crew Neck</h4>
-                <p class="price">$19.99</p>
-                <a href="/lfi?file=classic_crew_neck_specs.txt" class="btn">View Details</a>
-            </div>
-            <div class="product-card">
-                 <img src="data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' width='200' height='150' viewBox='0 0 200 150'%3E%3Crect width='100%25' height='100%25' fill='%23cccccc'/%3E%3Ctext x='50%25' y='50%25' fill='%23ffffff' dominant-baseline='middle' text-anchor='middle' font-size='16px'%3ETee Placeholder%3C/text%3E%3C/svg%3E" alt="T-Shirt Placeholder">
-                <h4>Custom Message Tee</h4>
-                <p class="price">$24.99</p>
-                <a href="/ssti?name=Your%20Message%20Here" class="btn">Personalize</a>
-            </div>
-             <div class="product-card">
-                 <img src="data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' width='200' height='150' viewBox='0 0 200 150'%3E%3Crect width='100%25' height='100%25' fill='%23cccccc'/%3E%3Ctext x='50%25' y='50%25' fill='%23ffffff' dominant-baseline='middle' text-anchor='middle' font-size='16px'%3ETee Placeholder%3C/text%3E%3C/svg%3E" alt="T-Shirt Placeholder">
-                <h4>Search Slogan Tee</h4>
-                 <p class="price">$21.99</p>
-                 <a href="/xss?input=ExampleSlogan" class="btn">Preview Slogan</a>
-            </div>
-             <div class="product-card">
-                 <img src="data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' width='200' height='150' viewBox='0 0 200 150'%3E%3Crect width='100%25' height='100%25' fill='%23cccccc'/%3E%3Ctext x='50%25' y='50%25' fill='%23ffffff' dominant-baseline='middle' text-anchor='middle' font-size='16px'%3ETee Placeholder%3C/text%3E%3C/svg%3E" alt="T-Shirt Placeholder">
-                <h4>Supplier Info Link</h4>
-                 <p class="price">N/A</p>
-                 <a href="/redirect?url=https://example.com/supplier-portal" class="btn btn-secondary">Visit Supplier</a>
-            </div>
-        </div>
-    </div>
+def negotiate_encoding():
+    """Returns the best content coding the client accepts that we can produce, or None."""
+    if not app.config['COMPRESS']:
+        return None
+    best, best_quality = None, 0
+    for encoding in available_encodings():
+        quality = request.accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress_body(data, encoding, static=False):
+    """Compresses a whole body, as hard as possible for static bodies that are compressed once."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if static else app.config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=9 if static else app.config['COMPRESS_GZIP_LEVEL'], mtime=0)
+
+def compress_variants(data, static=False):
+    """Returns {encoding: compressed body} for every encoding we can produce."""
+    return {encoding: compress_body(data, encoding, static) for encoding in available_encodings()}
+
+def stream_compressed(chunks, encoding):
+    """Compresses a streamed body chunk by chunk, flushing after each so the client sees progress."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=app.config['COMPRESS_BROTLI_QUALITY'])
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(app.config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)  # 31: gzip framing
+        compress, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def send_precompressed(body, variants, etag=None):
+    """Sends a body compressed ahead of time, in the client's preferred encoding when there's one."""
+    encoding = negotiate_encoding()
+    if encoding in variants:
+        response = make_response(variants[encoding])
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = make_response(body)
+    response.vary.add('Accept-Encoding')
+    if etag is not None:
+        # Every encoding is its own representation and needs its own strong ETag
+        response.set_etag(f'{etag}-{encoding}' if encoding in variants else etag)
+    return response
+
+# --- Static Assets & Page Shell ---
+
+# Stylesheet is served from a fingerprinted URL so browsers can cache it forever
+STYLES_CSS = minify_css(get_styles()).encode('utf-8')
+STYLES_HASH = hashlib.sha256(STYLES_CSS).hexdigest()[:12]
+STYLES_URL = f'/static/styles.{STYLES_HASH}.css'
+STYLES_CSS_VARIANTS = compress_variants(STYLES_CSS, static=True)
+
+# Navigation links - make them sound standard
+NAV_LINKS = {
+    'home': '/',
+    'designs': '#designs',
+    'upload_design': '/upload',
+    'order_status': '/sql?id=1'
+}
+
+def build_nav_html(current_page=None):
+    """Returns the navbar links HTML with current_page marked active."""
+    nav_html = ""
+    for name, url in NAV_LINKS.items():
+        active_class = 'active' if name == current_page else ''
+        # Make names user-friendly
+        display_name = name.replace("_", " ").title()
+        if name == 'designs': display_name = 'Our Designs'
+        if name == 'upload_design': display_name = 'Upload Your Design'
+        if name == 'order_status': display_name = 'Order Status'
+
+        nav_html += f'<a href="{url}" class="{active_class}">{display_name}</a> '
+    return nav_html
+
+# One prebuilt navbar per page, None is the "nothing active" variant
+NAV_HTML = {page: build_nav_html(page) for page in [None, *NAV_LINKS]}
+
+# Unchanging parts of the layout, render_page() joins the per-request pieces in between
+PAGE_SHELL_HEAD = minify_html("""
+    <!doctype html>
+    <html lang="en">
+    <head>
+        <meta charset="utf-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no">
+        <title>""")
+PAGE_SHELL_NAV = minify_html(f""" - Trendy Tees</title>
+        <link rel="stylesheet" href="{STYLES_URL}">
+    </head>
+    <body>
+        <header class="header">
+             <h1><a href="/">Trendy Tees</a></h1>
+             <nav class="navbar">
+                """)
+PAGE_SHELL_NAV_SEP = minify_html("""
+                """)
+PAGE_SHELL_MAIN = minify_html("""
+             </nav>
+        </header>
+
+        <div class="container">
+            <main class="main-content">
+                <h2>""")
+PAGE_SHELL_CONTENT = minify_html("""</h2>
+                """)
+PAGE_SHELL_FOOT = minify_html("""
+            </main>
+        </div>
+
+        <footer class="footer">
+            <p>&copy; 2024 Trendy Tees - Custom Apparel</p>
+        </footer>
+    </body>
+    </html>
+    """)
+
+@app.route('/static/styles.<css_hash>.css')
+def static_styles(css_hash):
+    response = send_precompressed(STYLES_CSS, STYLES_CSS_VARIANTS)
+    response.headers['Content-Type'] = 'text/css; charset=utf-8'
+    if css_hash == STYLES_HASH:
+        # Content-addressed URL, the bytes behind it never change
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        # Stale fingerprint from an old cached page, serve the current sheet but don't pin it
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+# --- Conditional Responses ---
+
+STATIC_PAGES = {}  # endpoint -> (etag, body, compressed variants) of pages every logged-out visitor gets byte for byte
+
+def compute_etag(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def static_page(render):
+    """Serves a page that only depends on being logged out from a body, ETag and compressed copies made once.
+
+    render is called by warm_static_pages() when the pre-fork server starts, or else by
+    the first logged-out request (and on every logged-in one), afterwards a matching
+    If-None-Match gets its 304 without anything being rendered or compressed.
+    Callers must only use this when the body doesn't depend on the request otherwise.
+    """
+    if 'username' in session:
+        return render()
+    page = STATIC_PAGES.get(request.endpoint)
+    if page is None:
+        body = render().encode('utf-8')
+        page = STATIC_PAGES[request.endpoint] = (compute_etag(body), body, compress_variants(body, static=True))
+    etag, body, variants = page
+    return send_precompressed(body, variants, etag)
+
+@app.after_request
+def add_conditional_headers(response):
+    # Complete 200 GET responses get a strong ETag and If-None-Match is answered with a 304.
+    # Files (send_file already did this) and streamed bodies are left alone.
+    if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+        return response
+    if response.direct_passthrough or response.is_streamed:
+        return response
+    if 'ETag' not in response.headers:
+        response.set_etag(compute_etag(response.get_data()))
+    return response.make_conditional(request)
+
+@app.after_request
+def compress_response(response):
+    # Registered after add_conditional_headers so it runs before it, and ETags are those of the bytes sent.
+    # Buffered bodies from COMPRESS_MIN_SIZE up are compressed whole, streamed ones chunk by chunk.
+    if 'Content-Encoding' in response.headers or response.direct_passthrough or request.method == 'HEAD':
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304) or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = stream_compressed(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress_body(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+# --- Wishlist Codes ---
+
+# The homepage's sample wishlist never changes, so its (pickle) code is built once
+try:
+    HOMEPAGE_WISHLIST_CODE = base64.urlsafe_b64encode(
+        pickle.dumps({'wishlist_id': 'wl-abc-789', 'items': ['T001', 'T004']})).decode('utf-8')
+except Exception:
+    HOMEPAGE_WISHLIST_CODE = ""
+
+# Compact wishlist codes: 'w1.' + unpadded urlsafe base64 of a little-endian struct
+#   B   item width in bytes (2 or 4)
+#   H   wishlist_id length, followed by the UTF-8 wishlist_id
+#   H/I item numbers for the rest of the payload, item 'T001' is stored as 1
+# Codes without the prefix are legacy pickle codes.
+WISHLIST_CODE_PREFIX = 'w1.'
+WISHLIST_ITEM_PREFIX = 'T'
+WISHLIST_ITEM_TABLE_SIZE = 10000 # Item numbers with a precomputed name (covers T000-T9999)
+_WISHLIST_ITEM_RE = re.compile(r'T(\d{3,})\Z')
+_wishlist_item_tables = None
+
+def get_wishlist_item_tables():
+    """Returns (names, numbers): item number -> item ID tuple and its reverse dict, built on first use."""
+    global _wishlist_item_tables
+    if _wishlist_item_tables is None:
+        names = tuple(f'{WISHLIST_ITEM_PREFIX}{number:03d}' for number in range(WISHLIST_ITEM_TABLE_SIZE))
+        _wishlist_item_tables = (names, {name: number for number, name in enumerate(names)})
+    return _wishlist_item_tables
+
+def wishlist_item_number(item):
+    match = _WISHLIST_ITEM_RE.match(item) if isinstance(item, str) else None
+    # Only IDs that format back to themselves ('T001', 'T12345', not 'T0001') have a compact form
+    if match is None or f'{WISHLIST_ITEM_PREFIX}{int(match.group(1)):03d}' != item:
+        raise ValueError(f"Item ID {item!r} has no compact form")
+    return int(match.group(1))
+
+_WISHLIST_KEYS = {'wishlist_id', 'items'}
+_WISHLIST_HEADER = struct.Struct('<BH')
+_WISHLIST_ITEM_FORMATS = {2: 'H', 4: 'I'}
+WISHLIST_STRUCT_CACHE_SIZE = 64 # Payloads with up to this many ID bytes and items are packed with a precompiled Struct
+_wishlist_structs = {}
+
+def wishlist_struct(id_length, count, fmt):
+    """Returns the Struct of a whole payload: header, id_length bytes of wishlist_id, then count items."""
+    key = (id_length, count, fmt)
+    packer = _wishlist_structs.get(key)
+    if packer is None:
+        # Parsing the format is most of what struct.pack costs for a short list
+        packer = struct.Struct(f'<BH{id_length}s{count}{fmt}')
+        if id_length <= WISHLIST_STRUCT_CACHE_SIZE and count <= WISHLIST_STRUCT_CACHE_SIZE:
+            _wishlist_structs[key] = packer
+    return packer
+
+# binascii plus translate tables, the base64 module wrappers cost more than the packing for small lists
+_B64_TO_URLSAFE = bytes.maketrans(b'+/', b'-_')
+_B64_FROM_URLSAFE = bytes.maketrans(b'-_', b'+/')
+_B64_PADDING = (b'', b'===', b'==', b'=')  # By unpadded length % 4
+
+def encode_wishlist(wishlist):
+    """Returns the compact 'w1.' code for a {'wishlist_id', 'items'} dict.
+
+    Raises ValueError when the wishlist can't be represented, callers can fall back to the legacy format.
+    """
+    if not isinstance(wishlist, dict) or wishlist.keys() != _WISHLIST_KEYS:
+        raise ValueError("Wishlist must have exactly 'wishlist_id' and 'items'")
+    wishlist_id = wishlist['wishlist_id']
+    items = wishlist['items']
+    if not isinstance(wishlist_id, str) or not isinstance(items, list):
+        raise ValueError("Wishlist must have a string 'wishlist_id' and a list of 'items'")
+    wishlist_id = wishlist_id.encode('utf-8')  # UnicodeEncodeError is a ValueError too
+    if len(wishlist_id) > 0xFFFF:
+        raise ValueError("Wishlist ID too long")
+    numbers_by_name = (_wishlist_item_tables or get_wishlist_item_tables())[1]
+    key = (len(wishlist_id), len(items), 'H')
+    try:
+        # Fast path, every ID is in the precomputed table so all numbers fit in 2 bytes
+        packed = (_wishlist_structs.get(key) or wishlist_struct(*key)).pack(2, key[0], wishlist_id, *map(numbers_by_name.__getitem__, items))
+    except (KeyError, TypeError):
+        numbers = [wishlist_item_number(item) for item in items]
+        top = max(numbers)
+        if top > 0xFFFFFFFF:
+            raise ValueError("Item number out of range")
+        width, fmt = (2, 'H') if top <= 0xFFFF else (4, 'I')
+        key = (key[0], len(numbers), fmt)
+        packed = (_wishlist_structs.get(key) or wishlist_struct(*key)).pack(width, key[0], wishlist_id, *numbers)
+    return WISHLIST_CODE_PREFIX + binascii.b2a_base64(packed, newline=False).translate(_B64_TO_URLSAFE).rstrip(b'=').decode('ascii')
+
+def decode_wishlist(code):
+    """Decodes a compact 'w1.' code back into the {'wishlist_id', 'items'} dict."""
+    payload = code[len(WISHLIST_CODE_PREFIX):].encode('ascii')
+    data = binascii.a2b_base64(payload.translate(_B64_FROM_URLSAFE) + _B64_PADDING[len(payload) % 4], strict_mode=True)
+    if len(data) < _WISHLIST_HEADER.size:
+        raise ValueError("Malformed wishlist code")
+    width, id_length = _WISHLIST_HEADER.unpack_from(data)
+    items_length = len(data) - _WISHLIST_HEADER.size - id_length
+    fmt = _WISHLIST_ITEM_FORMATS.get(width)
+    if fmt is None or items_length < 0 or items_length % width:
+        raise ValueError("Malformed wishlist code")
+    key = (id_length, items_length // width, fmt)
+    _, _, wishlist_id, *numbers = (_wishlist_structs.get(key) or wishlist_struct(*key)).unpack(data)
+    names = (_wishlist_item_tables or get_wishlist_item_tables())[0]
+    try:
+        items = [names[number] for number in numbers]
+    except IndexError:
+        items = [f'{WISHLIST_ITEM_PREFIX}{number:03d}' for number in numbers]
+    return {'wishlist_id': wishlist_id.decode('utf-8'), 'items': items}
+
+# Everything on the homepage below the welcome message, the same for every visitor
+HOME_SECTIONS_HTML = minify_html(f"""
+    <div id="designs" class="content-section">
+        <h3>Shop Our Designs</h3>
+        <div class="product-grid">
+            <div class="product-card">
+                 <img src="data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' width='200' height='150' viewBox='0 0 200 150'%3E%3Crect width='100%25' height='100%25' fill='%23cccccc'/%3E%3Ctext x='50%25' y='50%25' fill='%23ffffff' dominant-baseline='middle' text-anchor='middle' font-size='16px'%3ETee Placeholder%3C/text%3E%3C/svg%3E" alt="T-Shirt Placeholder">
+                <h4>Classic Crew Neck</h4>
+                <p class="price">$19.99</p>
+                <a href="/lfi?file=classic_crew_neck_specs.txt" class="btn">View Details</a>
+            </div>
+            <div class="product-card">
+                 <img src="data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' width='200' height='150' viewBox='0 0 200 150'%3E%3Crect width='100%25' height='100%25' fill='%23cccccc'/%3E%3Ctext x='50%25' y='50%25' fill='%23ffffff' dominant-baseline='middle' text-anchor='middle' font-size='16px'%3ETee Placeholder%3C/text%3E%3C/svg%3E" alt="T-Shirt Placeholder">
+                <h4>Custom Message Tee</h4>
+                <p class="price">$24.99</p>
+                <a href="/ssti?name=Your%20Message%20Here" class="btn">Personalize</a>
+            </div>
+             <div class="product-card">
+                 <img src="data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' width='200' height='150' viewBox='0 0 200 150'%3E%3Crect width='100%25' height='100%25' fill='%23cccccc'/%3E%3Ctext x='50%25' y='50%25' fill='%23ffffff' dominant-baseline='middle' text-anchor='middle' font-size='16px'%3ETee Placeholder%3C/text%3E%3C/svg%3E" alt="T-Shirt Placeholder">
+                <h4>Search Slogan Tee</h4>
+                 <p class="price">$21.99</p>
+                 <a href="/xss?input=ExampleSlogan" class="btn">Preview Slogan</a>
+            </div>
+             <div class="product-card">
+                 <img src="data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' width='200' height='150' viewBox='0 0 200 150'%3E%3Crect width='100%25' height='100%25' fill='%23cccccc'/%3E%3Ctext x='50%25' y='50%25' fill='%23ffffff' dominant-baseline='middle' text-anchor='middle' font-size='16px'%3ETee Placeholder%3C/text%3E%3C/svg%3E" alt="T-Shirt Placeholder">
+                <h4>Supplier Info Link</h4>
+                 <p class="price">N/A</p>
+                 <a href="/redirect?url=https://example.com/supplier-portal" class="btn btn-secondary">Visit Supplier</a>
+            </div>
+        </div>
+    </div>
 
     <div id="tools" class="content-section">
         <h3>Customer Tools</h3>
         <ul>
             <li><strong>Order Status:</strong> Check your <a href="/sql?id=12345">Order Status by ID</a>.</li>
-            <li><strong>Load Wishlist:</strong> <a href="/deserialize?data={encoded_pickle}">Load Your Saved Wishlist</a>.</li>
+            <li><strong>Load Wishlist:</strong> <a href="/deserialize?data={HOMEPAGE_WISHLIST_CODE}">Load Your Saved Wishlist</a>.</li>
              <li><strong>Get Order Code:</strong> <a href="/weak_hash?data=order12345">Generate Simple Code</a> for order 'order12345'.</li>
             <li><strong>Upload Custom Design:</strong> <a href="/upload">Upload Your Artwork</a>.</li>
             <li><strong>Verify Supplier:</strong> <a href="/check-supplier">Verify Supplier Website</a>.</li>
@@ -616,11 +2006,57 @@ def index():
             <li><small><em>Internal Use:</em> <a href="/command?cmd=id">System Check</a></small></li>
         </ul>
     </div>
-    """
-    return render_page("Home", content, current_page='home')
+""")
+
+@app.route('/')
+def index():
+    """Modified homepage to check for session."""
+    # Welcome message based on login status
+    welcome_msg = ""
+    if 'username' in session:
+        welcome_msg = f"<p>Welcome back, <strong>{escape(session['username'])}</strong>! "
+        welcome_msg += "Find the perfect custom t-shirt or browse our collection.</p>"
+    else:
+        welcome_msg = "<p>Welcome to Trendy Tees! Find the perfect custom t-shirt or browse our unique collection.</p>"
+        welcome_msg += "<p><a href='/login' class='btn'>Log In</a> or <a href='/register' class='btn btn-secondary'>Create Account</a></p>"
+
+    content = welcome_msg + HOME_SECTIONS_HTML
+    return static_page(lambda: render_page("Home", content, current_page='home'))
 
 # --- Vulnerability Routes (Wrapped & Obfuscated) ---
 
+_lfi_file_cache = None
+
+def get_lfi_file_cache():
+    global _lfi_file_cache
+    if _lfi_file_cache is None:
+        _lfi_file_cache = LRUCache(maxsize=8)
+    return _lfi_file_cache
+
+def read_escaped_file(path, st):
+    """Returns the HTML-escaped text of a file, cached until its mtime or size changes."""
+    key = (path, st.st_mtime_ns, st.st_size)
+    cache = get_lfi_file_cache()
+    content = cache.get(key)
+    if content is None:
+        with open(path, 'r') as f:
+            content = str(escape(f.read()))
+        cache.put(key, content)
+    return content
+
+def read_escaped_file_gzip(path, st):
+    """Returns read_escaped_file()'s text compressed as one gzip member, cached the same way."""
+    key = (path, st.st_mtime_ns, st.st_size, 'gzip')
+    cache = get_lfi_file_cache()
+    member = cache.get(key)
+    if member is None:
+        member = compress_body(read_escaped_file(path, st).encode('utf-8'), 'gzip', static=True)
+        cache.put(key, member)
+    return member
+
+def accepts_gzip():
+    return app.config['COMPRESS'] and request.accept_encodings.quality('gzip') > 0
+
 @app.route('/lfi')
 def lfi():
     # Reframe as viewing product details
@@ -641,11 +2077,23 @@ def lfi():
     try:
         # Check if the *secretly* read file exists
         if os.path.exists(file_path) and os.path.abspath(file_path) == os.path.abspath(__file__):
-             with open(file_path, 'r') as f:
-                content_data = f.read()
-             # Pretend the content is for the requested filename
-             file_content_html = f"<h3>Details for '{escape(filename)}':</h3><pre>{escape(content_data)}</pre>"
-             file_content_html += f"<p class='flash info'>Displaying default details. File requested: '{escape(filename)}'.</p>" # Less alarming message
+             # Pretend the content is for the requested filename, the escaped file is cached per version
+             st = os.stat(file_path)
+             before = f"<h3>Details for '{escape(filename)}':</h3><pre>"
+             after = f"</pre><p class='flash info'>Displaying default details. File requested: '{escape(filename)}'.</p>" # Less alarming message
+             if accepts_gzip():
+                 # Gzip members can be concatenated (RFC 1952): the file's member is compressed once per
+                 # version, only the small per-request head and tail are compressed here. Brotli can't be
+                 # stitched together like this, so gzip is used even for clients that prefer br
+                 response = make_response(b''.join((
+                     compress_body((page_shell_head(title) + before).encode('utf-8'), 'gzip'),
+                     read_escaped_file_gzip(file_path, st),
+                     compress_body((after + PAGE_SHELL_FOOT).encode('utf-8'), 'gzip'),
+                 )))
+                 response.headers['Content-Encoding'] = 'gzip'
+                 response.vary.add('Accept-Encoding')
+                 return response
+             file_content_html = before + read_escaped_file(file_path, st) + after
         else:
              file_content_html = f"<p class='flash error'>Could not load details for '{escape(filename)}'.</p>"
              status_code = 404 # More appropriate error
@@ -658,6 +2106,25 @@ def lfi():
     # Don't show debug info to regular users
     return render_page(title, file_content_html), status_code
 
+_template_cache = None
+
+def get_template_cache():
+    global _template_cache
+    if _template_cache is None:
+        _template_cache = LRUCache(maxsize=app.config['SSTI_TEMPLATE_CACHE_SIZE'])
+    return _template_cache
+
+def render_cached_template_string(source, **context):
+    """Like render_template_string, but compiled templates are reused, keyed on a hash of the source."""
+    key = hashlib.blake2b(source.encode('utf-8'), digest_size=16).digest()
+    cache = get_template_cache()
+    template = cache.get(key)
+    if template is None:
+        template = app.jinja_env.from_string(source)
+        cache.put(key, template)
+    # Flask's own render path: context processors (request, session, g, config) and the template signals
+    return render_flask_template(app, template, context)
+
 @app.route('/ssti')
 def ssti():
     # Reframe as custom message preview
@@ -668,8 +2135,8 @@ def ssti():
     template_string = f"<h3>Your Custom Message:</h3><div class='card' style='font-size: 1.5em; text-align: center;'>{name}</div><p>Enter your desired message in the 'name' parameter in the URL.</p>"
     # ---
     try:
-        # render_template_string still processes the user input
-        rendered_template = render_template_string(template_string)
+        # Still rendered as a template, compiled once per distinct message and then reused
+        rendered_template = render_cached_template_string(template_string)
         return render_page(title, rendered_template)
     except Exception as e:
         error_content = f"<p class='flash error'>Could not preview message.</p><p>Input: {escape(name)}</p>"
@@ -699,6 +2166,49 @@ def reflected_xss():
     # ---
     return render_page(title, response_html_content)
 
+class CommandRunner:
+    """Runs the /command checks, whose output doesn't change while the process lives.
+
+    Outputs are cached for COMMAND_CACHE_TTL and concurrent runs of one command share
+    a single spawn. Executables are resolved to absolute paths once, which together
+    with close_fds=False lets subprocess use posix_spawn (vfork otherwise) instead of
+    fork + exec. Our own descriptors are all close-on-exec, so none leak to the child.
+    """
+
+    def __init__(self, ttl):
+        self.cache = LRUCache(maxsize=16, ttl=ttl)
+        self.flight = SingleFlight()
+        self.paths = {}  # command -> absolute executable path
+        self.spawns = 0
+        self.pid = os.getpid()
+
+    @property
+    def spawns_avoided(self):
+        return self.cache.hits + self.flight.coalesced
+
+    def run(self, command):
+        output = self.cache.get(command)
+        if output is None:
+            output = self.flight.do(command, lambda: self._spawn(command))
+        return output
+
+    def _spawn(self, command):
+        path = self.paths.get(command)
+        if path is None:
+            path = self.paths[command] = shutil.which(command) or command
+        self.spawns += 1
+        result = subprocess.run([path], capture_output=True, text=True, check=True, shell=False, close_fds=False)
+        self.cache.put(command, result.stdout)
+        return result.stdout
+
+_command_runner = None
+
+def get_command_runner():
+    global _command_runner
+    if _command_runner is None or _command_runner.pid != os.getpid():
+        _command_runner = CommandRunner(app.config['COMMAND_CACHE_TTL'])
+    return _command_runner
+
 @app.route('/command')
 def command_injection():
     # Reframe as an internal tool, less visible
@@ -711,8 +2221,8 @@ def command_injection():
         if command_param in allowed_commands:
             try:
                 # --- Command Injection Pattern Preserved (but restricted) ---
-                result = subprocess.run([command_param], capture_output=True, text=True, check=True, shell=False)
-                output_html = f"<h3>Check Result '{escape(command_param)}':</h3><pre>{escape(result.stdout)}</pre>"
+                output = get_command_runner().run(command_param)
+                output_html = f"<h3>Check Result '{escape(command_param)}':</h3><pre>{escape(output)}</pre>"
             except Exception as e:
                 output_html = f"<p class='flash error'>Check '{escape(command_param)}' failed.</p>"
                 print(f"Command route error: {e}") # Log real error
@@ -755,9 +2265,13 @@ def insecure_deserialization():
         # Don't return 400, just show info message
     else:
         try:
-            pickled_data = base64.urlsafe_b64decode(encoded_data)
-            # --- Deserialization Vulnerability Preserved ---
-            deserialized_object = pickle.loads(pickled_data)
+            if encoded_data.startswith(WISHLIST_CODE_PREFIX):
+                # Compact fixed-layout code, plain struct unpacking
+                deserialized_object = decode_wishlist(encoded_data)
+            else:
+                pickled_data = base64.urlsafe_b64decode(encoded_data)
+                # --- Deserialization Vulnerability Preserved ---
+                deserialized_object = pickle.loads(pickled_data)
             result_html = f"<h3>Wishlist Loaded</h3><p>Items:</p><pre>{escape(str(deserialized_object))}</pre>"
             # ---
         except Exception as e:
@@ -784,6 +2298,471 @@ def weak_hash():
     """
     return render_page(title, content)
 
+# --- Upload Store ---
+
+# Uploads are stored once per content, as <upload folder>/.objects/<sha256[:2]>/<sha256[2:]>, and every
+# uploaded name is a hardlink to its object. The store is shared by all labs so a class uploading the same
+# sample design keeps one copy. Objects are never written to after they're stored: a new upload of a name
+# is linked next to it and renamed over it, like any other upload.
+UPLOAD_OBJECTS_DIR = '.objects'
+
+class HashingUploadFile:
+    """Temporary file in the object store an upload is written to by the form parser, hashed as it arrives."""
+
+    def __init__(self, folder):
+        fd, self.path = tempfile.mkstemp(dir=folder, prefix='.incoming-')
+        self.file = os.fdopen(fd, 'w+b')
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def close(self):
+        # The request closes its files when it ends, which throws away the temporary file
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class UploadStore:
+    """Content-addressed storage for uploads, see above."""
+
+    def __init__(self, folder):
+        self.pid = os.getpid()
+        self.folder = folder
+        self.stored = 0
+        self.deduplicated = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def new_file(self):
+        return HashingUploadFile(self.folder)
+
+    def object_path(self, digest):
+        return os.path.join(self.folder, digest[:2], digest[2:])
+
+    def _store(self, stream, object_path):
+        """Stores the upload's temporary file as the object unless it's there already. Returns whether it stored it."""
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        try:
+            os.link(stream.path, object_path)
+        except FileExistsError:
+            return False
+        except OSError:
+            os.replace(stream.path, object_path)  # Filesystem without hardlinks
+        return True
+
+    def put(self, upload, path):
+        """Makes path a link to the object holding the upload's content, storing the object if it's new. Returns the digest."""
+        stream = upload.stream
+        if not isinstance(stream, HashingUploadFile):
+            # Parsed before the upload route could ask for a hashing file, copy it into one
+            stream = self.new_file()
+            upload.stream.seek(0)
+            shutil.copyfileobj(upload.stream, stream, 64 * 1024)
+        try:
+            stream.flush()
+            digest = stream.sha256.hexdigest()
+            object_path = self.object_path(digest)
+            os.chmod(stream.path, 0o644)
+            stored = self._store(stream, object_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            part_path = f'{path}.{uuid.uuid4().hex}.part'
+            try:
+                try:
+                    link_or_copy(object_path, part_path)  # Copies when the lab's folder is on another filesystem
+                except FileNotFoundError:
+                    if stored:
+                        raise
+                    # The object was orphaned and the sweeper deleted it after our dedup hit, store it again
+                    stored = self._store(stream, object_path)
+                    link_or_copy(object_path, part_path)
+                os.replace(part_path, path)
+            except BaseException:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise
+        finally:
+            if stream is not upload.stream:
+                stream.close()
+        if stored:
+            self.stored += 1
+        else:
+            self.deduplicated += 1
+        return digest
+
+_upload_store = None
+
+def get_upload_store():
+    global _upload_store
+    if _upload_store is None or _upload_store.pid != os.getpid():
+        _upload_store = UploadStore(os.path.join(app.config['UPLOAD_FOLDER'], UPLOAD_OBJECTS_DIR))
+    return _upload_store
+
+class UploadRequest(Request):
+    """Request whose /upload file parts are written straight into the upload store's temporary files."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint == 'upload_file':
+            stream = get_upload_store().new_file()
+            # Kept here too, a body refused halfway through never makes it into request.files
+            self.__dict__.setdefault('upload_streams', []).append(stream)
+            return stream
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+    def close(self):
+        for stream in self.__dict__.pop('upload_streams', ()):
+            stream.close()
+        super().close()
+
+app.request_class = UploadRequest
+
+# --- Upload Layout ---
+
+# A lab's uploads live in 256 shard directories, <upload folder>/<blake2b(name) as 2 hex digits>/<name>,
+# instead of all in one directory. Uploads from before the sharded layout stay where they are until
+# `flask uploads migrate` moves them, and are found there in the meantime.
+UPLOAD_SHARD_RE = re.compile(r'^[0-9a-f]{2}$')
+
+def upload_shard(name):
+    return hashlib.blake2b(name.encode('utf-8', 'surrogateescape'), digest_size=1).hexdigest()
+
+def upload_path(folder, name):
+    """Returns where upload `name` belongs in a lab's upload folder."""
+    if name in ('', '.', '..') or '/' in name or os.sep in name:
+        # Not a name uploads are saved under, taken as a path relative to the folder like it always was
+        return os.path.join(folder, name)
+    return os.path.join(folder, upload_shard(name), name)
+
+def find_upload(folder, name):
+    """Like upload_path, but finds uploads that haven't been migrated to the sharded layout yet."""
+    path = upload_path(folder, name)
+    flat_path = os.path.join(folder, name)
+    if path != flat_path and not os.path.exists(path) and os.path.exists(flat_path):
+        return flat_path
+    return path
+
+def iter_upload_entries(path):
+    """Yields the DirEntry of each upload directly in path, skipping hidden files and unfinished .part files."""
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if not entry.name.startswith('.') and not entry.name.endswith('.part') and entry.is_file(follow_symlinks=False):
+                    yield entry
+    except FileNotFoundError:
+        return
+
+def list_upload_shards(folder):
+    """Returns the names of the shard directories in a lab's upload folder."""
+    try:
+        with os.scandir(folder) as entries:
+            return [entry.name for entry in entries if UPLOAD_SHARD_RE.match(entry.name) and entry.is_dir(follow_symlinks=False)]
+    except FileNotFoundError:
+        return []
+
+def iter_lab_upload_folders():
+    """Yields the upload folder of every lab, the single (default) lab's first."""
+    yield app.config['UPLOAD_FOLDER']
+    tenants = os.path.join(app.config['UPLOAD_FOLDER'], 'tenants')
+    if os.path.isdir(tenants):
+        yield from sorted(entry.path for entry in os.scandir(tenants) if entry.is_dir(follow_symlinks=False))
+
+def migrate_uploads(folder):
+    """Moves a lab's uploads from the flat layout into their shards. Returns (moved, dropped)."""
+    moved = dropped = 0
+    for entry in list(iter_upload_entries(folder)):
+        path = upload_path(folder, entry.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            # Linking fails rather than overwriting, an upload may have arrived at the new path meanwhile
+            os.link(entry.path, path)
+        except FileExistsError:
+            dropped += 1  # Uploaded again since the layout changed, that copy is the newer one
+        except OSError:
+            if os.path.exists(path):
+                dropped += 1
+            else:
+                os.rename(entry.path, path)  # Filesystem without hardlinks
+                moved += 1
+                continue
+        else:
+            moved += 1
+        os.remove(entry.path)
+    return moved, dropped
+
+# Upload times, per lab and name. An upload is a link to the one stored object of its content, so
+# the inode's mtime is shared by every lab that uploaded those bytes (and kept by snapshot restores)
+# and doesn't tell how old one lab's upload is.
+UPLOAD_TIMES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_times (
+    lab TEXT NOT NULL,
+    name TEXT NOT NULL,
+    uploaded_at REAL NOT NULL,
+    PRIMARY KEY (lab, name)
+) WITHOUT ROWID;
+"""
+_upload_times_ready = set()
+
+def get_upload_times_db():
+    path = app.config['UPLOAD_DB_PATH']
+    db = get_db(path)
+    if path not in _upload_times_ready:
+        db.executescript(UPLOAD_TIMES_SCHEMA)
+        _upload_times_ready.add(path)
+    return db
+
+def upload_lab(folder):
+    """Returns the key of a lab's upload folder in upload_times, '' for the default lab."""
+    lab = os.path.relpath(folder, app.config['UPLOAD_FOLDER'])
+    return '' if lab == '.' else lab
+
+def record_upload_times(folder, names, uploaded_at, replace_all=False):
+    """Sets the upload time of names in a lab, with replace_all forgetting every other name of the lab."""
+    lab = upload_lab(folder)
+    db = get_upload_times_db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        if replace_all:
+            db.execute('DELETE FROM upload_times WHERE lab = ?', (lab,))
+        db.executemany('INSERT OR REPLACE INTO upload_times (lab, name, uploaded_at) VALUES (?, ?, ?)',
+                       ((lab, name, uploaded_at) for name in names))
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+
+def forget_upload_times(folder, names):
+    lab = upload_lab(folder)
+    get_upload_times_db().executemany('DELETE FROM upload_times WHERE lab = ? AND name = ?', ((lab, name) for name in names))
+
+def get_upload_times(folder, names=None):
+    """Returns {name: uploaded_at} of a lab's uploads, only of names if given."""
+    lab = upload_lab(folder)
+    db = get_upload_times_db()
+    if names is None:
+        return dict(db.execute('SELECT name, uploaded_at FROM upload_times WHERE lab = ?', (lab,)))
+    names = list(names)
+    if not names:
+        return {}
+    return dict(db.execute(f"SELECT name, uploaded_at FROM upload_times WHERE lab = ? AND name IN ({', '.join('?' * len(names))})",
+                           (lab, *names)))
+
+def iter_lab_uploads(folder):
+    """Yields the DirEntry of every upload in a lab, the ones not migrated to the sharded layout first."""
+    for shard in ['', *list_upload_shards(folder)]:
+        yield from iter_upload_entries(os.path.join(folder, shard))
+
+class UploadIndex:
+    """In-memory listing of one lab's uploads, in name order for paging.
+
+    Built with os.scandir and refreshed shard by shard: a directory is only read again when its
+    inode or mtime changed, so uploads from other workers, the sweeper and snapshot restores show
+    up without rescanning the whole folder. Uploads through this process are added right away.
+    Only names are kept, sizes and upload times are looked up for the page being shown.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._names = []  # Sorted
+        self._shard_of = {}  # name -> a shard it was found in
+        self._dirs = {}  # shard ('' for the top level) -> ((st_ino, st_mtime_ns), names in it)
+        self._unsorted = False
+        self.scans = 0
+
+    def _other_shard(self, name):
+        """Another scanned directory holding the name (an upload not migrated yet can be both flat and sharded), or None."""
+        for shard in ('', upload_shard(name)):
+            if name in self._dirs.get(shard, (None, ()))[1]:
+                return shard
+        return None
+
+    def _update(self, shard, signature, names):
+        _, old = self._dirs.pop(shard, (None, set()))
+        removed = []
+        for name in old - names:
+            other = self._other_shard(name)
+            if other is None:
+                del self._shard_of[name]
+                removed.append(name)
+            else:
+                self._shard_of[name] = other
+        added = [name for name in names if name not in self._shard_of]
+        self._shard_of.update(dict.fromkeys(names, shard))
+        if self._unsorted or len(removed) + len(added) > 64:
+            self._unsorted = True  # Sorted once refresh() is done with every directory
+        else:
+            for name in removed:
+                del self._names[bisect.bisect_left(self._names, name)]
+            for name in added:
+                bisect.insort(self._names, name)
+        if signature is not None:
+            self._dirs[shard] = (signature, names)
+
+    def _scan(self, shard):
+        path = os.path.join(self.folder, shard)
+        try:
+            st = os.stat(path)
+            signature = (st.st_ino, st.st_mtime_ns)
+        except FileNotFoundError:
+            signature = None
+        if signature is not None and self._dirs.get(shard, (None,))[0] == signature:
+            return
+        self.scans += 1
+        self._update(shard, signature, {entry.name for entry in iter_upload_entries(path)})
+
+    def refresh(self):
+        with self._lock:
+            shards = list_upload_shards(self.folder)
+            for shard in self._dirs.keys() - {'', *shards}:
+                self._update(shard, None, set())
+            for shard in ['', *shards]:
+                self._scan(shard)
+            if self._unsorted:
+                self._names = sorted(self._shard_of)
+                self._unsorted = False
+
+    def add(self, name, path):
+        record_upload_times(self.folder, [name], time.time())
+        shard = os.path.relpath(os.path.dirname(path), self.folder)
+        with self._lock:
+            if name not in self._shard_of:
+                bisect.insort(self._names, name)
+            self._shard_of[name] = '' if shard == '.' else shard
+
+    def page(self, after='', limit=50):
+        """Returns ([(name, size, uploaded_at)] of up to limit uploads named after `after`, whether there are more)."""
+        self.refresh()
+        with self._lock:
+            start = bisect.bisect_right(self._names, after)
+            names = [(name, self._shard_of[name]) for name in self._names[start:start + limit + 1]]
+        times = get_upload_times(self.folder, (name for name, _ in names[:limit]))
+        rows = []
+        for name, shard in names[:limit]:
+            try:
+                st = os.stat(os.path.join(self.folder, shard, name))
+            except FileNotFoundError:
+                continue  # Deleted since the last refresh
+            rows.append((name, st.st_size, times.get(name, st.st_mtime)))
+        return rows, len(names) > limit
+
+    def __len__(self):
+        return len(self._names)
+
+_upload_indexes = None
+
+def get_upload_indexes():
+    global _upload_indexes
+    if _upload_indexes is None:
+        _upload_indexes = LRUCache(maxsize=app.config['UPLOAD_INDEX_FOLDERS'])
+    return _upload_indexes
+
+def get_upload_index(folder):
+    indexes = get_upload_indexes()
+    index = indexes.get(folder)
+    if index is None:
+        index = UploadIndex(folder)
+        indexes.put(folder, index)
+    return index
+
+class UploadSweeper:
+    """Deletes uploads older than UPLOAD_TTL, then the stored objects nothing links to any more.
+
+    Runs as a daemon thread in every process, a lock file in the object store lets only one of them
+    sweep at a time. Deletions come in batches of UPLOAD_SWEEP_BATCH with a short pause in between.
+    """
+
+    BATCH_PAUSE = 0.2
+
+    def __init__(self, ttl, interval, batch_size, start=True):
+        self.pid = os.getpid()
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.uploads_deleted = 0
+        self.objects_deleted = 0
+        self.thread = threading.Thread(target=self.run, name='upload-sweeper', daemon=True)
+        if start:
+            self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Upload sweeper error: {e}") # Log real error
+            time.sleep(self.interval)
+
+    def iter_expired(self, now):
+        cutoff = now - self.ttl
+        for folder in iter_lab_upload_folders():
+            times = get_upload_times(folder)
+            seen = set()
+            for entry in iter_lab_uploads(folder):
+                seen.add(entry.name)
+                if times.get(entry.name, now) < cutoff:
+                    yield entry.path, 'uploads_deleted'
+            # Uploads with no time on record (copied in by hand, or from before upload times were kept)
+            # count from the first sweep that sees them, records of uploads that are gone are dropped
+            record_upload_times(folder, seen - times.keys(), now)
+            forget_upload_times(folder, times.keys() - seen)
+        store = get_upload_store()
+        for shard in list_upload_shards(store.folder):
+            for entry in iter_upload_entries(os.path.join(store.folder, shard)):
+                st = entry.stat(follow_symlinks=False)
+                # Unlinking an upload sets its object's ctime, objects left with no other link get a
+                # sweep interval of grace in case an upload of the same content is linking them right now
+                if st.st_nlink == 1 and st.st_ctime < now - self.interval:
+                    yield entry.path, 'objects_deleted'
+        # Temporary files of uploads that never finished (the process died)
+        for entry in os.scandir(store.folder):
+            if entry.name.startswith('.incoming-') and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                yield entry.path, None
+
+    def sweep(self):
+        """One pass over every lab, returns the number of files deleted (0 if another process is sweeping)."""
+        with open(os.path.join(get_upload_store().folder, '.sweeper.lock'), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            deleted = 0
+            for path, counter in self.iter_expired(time.time()):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                if counter:
+                    setattr(self, counter, getattr(self, counter) + 1)
+                deleted += 1
+                if deleted % self.batch_size == 0:
+                    time.sleep(self.BATCH_PAUSE)
+            return deleted
+
+_upload_sweeper = None
+
+def get_upload_sweeper():
+    global _upload_sweeper
+    if _upload_sweeper is None or _upload_sweeper.pid != os.getpid():
+        _upload_sweeper = UploadSweeper(app.config['UPLOAD_TTL'], app.config['UPLOAD_SWEEP_INTERVAL'],
+                                        app.config['UPLOAD_SWEEP_BATCH'])
+    return _upload_sweeper
+
+@app.before_request
+def start_upload_sweeper():
+    # Threads don't survive a fork, so each (pre-fork worker) process starts its own on its first request
+    if app.config['UPLOAD_TTL'] > 0 and (_upload_sweeper is None or _upload_sweeper.pid != os.getpid()):
+        get_upload_sweeper()
+
 @app.route('/upload', methods=['GET', 'POST'])
 def upload_file():
     # Reframe as uploading a custom t-shirt design
@@ -795,7 +2774,7 @@ def upload_file():
       <input type=file name=file id="file" accept="image/*,.txt,.pdf,.py,.html"> <!-- Slightly better hint -->
       <input type=submit value="Upload Design" class="btn">
     </form>
-    <p><small>Your design will be processed shortly.</small></p>
+    <p><small>Your design will be processed shortly. <a href="/uploads">See your uploads</a>.</small></p>
     '''
 
     messages_html = ""
@@ -809,7 +2788,14 @@ def upload_file():
              messages_html += f'<div class="flash {category}">{escape(display_message)}</div>'
 
     if request.method == 'POST':
-        if 'file' not in request.files:
+        # Enforced while the body is read, a larger upload is refused before it's all on disk
+        request.max_content_length = app.config['UPLOAD_MAX_SIZE']
+        try:
+            has_file = 'file' in request.files
+        except RequestEntityTooLarge:
+            flash(f"Design is too large, the limit is {app.config['UPLOAD_MAX_SIZE'] // (1024 * 1024)} MB.", 'error')
+            return redirect(request.url)
+        if not has_file:
             flash('No file part selected.', 'error')
             return redirect(request.url)
         file = request.files['file']
@@ -820,9 +2806,10 @@ def upload_file():
         if file and allowed_file(file.filename):
             # --- File Upload Vulnerability Preserved ---
             filename = secure_filename(file.filename) # Basic sanitization still used
-            save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename) # Saved to predictable location
+            save_path = upload_path(get_upload_folder(), filename) # Saved to predictable location
             try:
-                file.save(save_path) # Actual save operation
+                get_upload_store().put(file, save_path) # Actual save operation, a link to the stored content
+                get_upload_index(get_upload_folder()).add(filename, save_path)
                 flash(f'Design "{filename}" uploaded successfully!', 'success')
             except Exception as e:
                  flash(f'Error saving design.', 'error') # Generic error message
@@ -834,9 +2821,87 @@ def upload_file():
             return redirect(request.url)
 
     # GET request
-    return render_page(title, messages_html + upload_form_html, current_page='upload_design')
+    if messages_html:
+        return render_page(title, messages_html + upload_form_html, current_page='upload_design')
+    return static_page(lambda: render_page(title, upload_form_html, current_page='upload_design'))
+
+@app.route('/uploads')
+def list_uploads():
+    # The lab's uploads in name order, ?after=<last name shown> is the next page
+    after = request.args.get('after', '')
+    rows, more = get_upload_index(get_upload_folder()).page(after, app.config['UPLOADS_PAGE_SIZE'])
+    rows_html = ''.join(
+        f"<tr><td><a href=\"/download?file={quote(name)}\">{escape(name)}</a></td>"
+        f"<td>{size / 1024:.1f} KB</td><td>{datetime.fromtimestamp(mtime):%Y-%m-%d %H:%M}</td></tr>"
+        for name, size, mtime in rows)
+    pager = ""
+    if after:
+        pager += '<a href="/uploads" class="btn btn-secondary">First Page</a> '
+    if more:
+        pager += f'<a href="/uploads?after={quote(rows[-1][0])}" class="btn">Next Page</a>'
+    content = f'''
+    <div class="card">
+        <h3>Your Uploads</h3>
+        <table border='1' style='width:100%; border-collapse: collapse;'>
+        <tr><th>Design</th><th>Size</th><th>Uploaded</th></tr>
+        {rows_html or "<tr><td colspan='3'>No uploads yet.</td></tr>"}
+        </table>
+        <p>{pager}</p>
+    </div>
+    <p><a href="/upload" class="btn btn-secondary">Upload a Design</a></p>
+    '''
+    return render_page("Your Uploads", content, current_page='upload_design')
+
+@app.cli.group()
+def uploads():
+    """Maintain the upload folders of every lab."""
+
+@uploads.command('migrate')
+def uploads_migrate_command():
+    """Move uploads from the old flat layout into shard directories."""
+    start = time.perf_counter()
+    for folder in iter_lab_upload_folders():
+        moved, dropped = migrate_uploads(folder)
+        if moved or dropped:
+            click.echo(f"{folder}: moved {moved}, dropped {dropped} older copies of uploads made since")
+    click.echo(f"Done in {time.perf_counter() - start:.1f} s")
+
+@uploads.command('sweep')
+@click.option('--ttl', type=float, help="Delete uploads older than this many seconds, default UPLOAD_TTL.")
+def uploads_sweep_command(ttl):
+    """Run one sweep now, without waiting for the background sweeper."""
+    ttl = app.config['UPLOAD_TTL'] if ttl is None else ttl
+    if ttl <= 0:
+        raise click.ClickException("Set UPLOAD_TTL or pass --ttl")
+    sweeper = UploadSweeper(ttl, app.config['UPLOAD_SWEEP_INTERVAL'], app.config['UPLOAD_SWEEP_BATCH'], start=False)
+    sweeper.sweep()
+    click.echo(f"Deleted {sweeper.uploads_deleted} uploads and {sweeper.objects_deleted} unused objects")
 
 # --- User Registration Route ---
+# Form shown by GET /register
+REGISTER_FORM_HTML = minify_html('''
+    <div class="card">
+        <h3>Create an Account</h3>
+        <form method="post">
+            <div class="form-group">
+                <label for="username">Username:</label>
+                <input type="text" id="username" name="username" required>
+            </div>
+            <div class="form-group">
+                <label for="email">Email:</label>
+                <input type="email" id="email" name="email" required>
+            </div>
+            <div class="form-group">
+                <label for="password">Password:</label>
+                <input type="password" id="password" name="password" required>
+                <small>Must be at least 4 characters long.</small>
+            </div>
+            <input type="submit" value="Register" class="btn">
+        </form>
+        <p>Already have an account? <a href="/login">Log in</a></p>
+    </div>
+    ''')
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -861,13 +2926,16 @@ def register():
             flash(error, 'error')
             return redirect(url_for('register'))
         
-        # Create the user
-        USERS[username] = {
+        # Create the user, another worker may have taken the name since the check above
+        created = USERS.create_user(username, {
             'password': password,  # VULNERABILITY: Stored in plaintext
             'email': email,
             'role': 'user',
             'created_at': time.time(),
-        }
+        })
+        if not created:
+            flash(f"Username '{username}' is already taken.", 'error')
+            return redirect(url_for('register'))
 
         flash(f"Registration successful! Welcome {username}.", 'success')
         # Log the user in
@@ -877,39 +2945,37 @@ def register():
         return redirect(url_for('index'))
     
     # GET request, show registration form
-    registration_form = '''
+    return static_page(lambda: render_page("Register", REGISTER_FORM_HTML))
+
+# --- User Login Route ---
+# Form shown by GET /login
+LOGIN_FORM_HTML = minify_html('''
     <div class="card">
-        <h3>Create an Account</h3>
+        <h3>Log In</h3>
         <form method="post">
             <div class="form-group">
                 <label for="username">Username:</label>
                 <input type="text" id="username" name="username" required>
             </div>
-            <div class="form-group">
-                <label for="email">Email:</label>
-                <input type="email" id="email" name="email" required>
-            </div>
             <div class="form-group">
                 <label for="password">Password:</label>
                 <input type="password" id="password" name="password" required>
-                <small>Must be at least 4 characters long.</small>
             </div>
-            <input type="submit" value="Register" class="btn">
+            <input type="submit" value="Log In" class="btn">
         </form>
-        <p>Already have an account? <a href="/login">Log in</a></p>
+        <p>Don't have an account? <a href="/register">Register</a></p>
     </div>
-    '''
-    return render_page("Register", registration_form)
+    ''')
 
-# --- User Login Route ---
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '').strip()
         
+        user = USERS.get(username)
         # VULNERABILITY: Timing attack possible here (though hard to exploit in practice)
-        if username in USERS and password == USERS[username]['password']:
+        if user is not None and password == user['password']:
             session['username'] = username
             # VULNERABILITY: Session fixation - not regenerating session ID after login
             
@@ -921,24 +2987,7 @@ def login():
             return redirect(url_for('login'))
     
     # GET request, show login form
-    login_form = '''
-    <div class="card">
-        <h3>Log In</h3>
-        <form method="post">
-            <div class="form-group">
-                <label for="username">Username:</label>
-                <input type="text" id="username" name="username" required>
-            </div>
-            <div class="form-group">
-                <label for="password">Password:</label>
-                <input type="password" id="password" name="password" required>
-            </div>
-            <input type="submit" value="Log In" class="btn">
-        </form>
-        <p>Don't have an account? <a href="/register">Register</a></p>
-    </div>
-    '''
-    return render_page("Login", login_form)
+    return static_page(lambda: render_page("Login", LOGIN_FORM_HTML))
 
 # --- Logout Route ---
 @app.route('/logout')
@@ -964,11 +3013,11 @@ def profile(username=None):
         username = session['username']
     
     # VULNERABILITY: IDOR - Can view any user's profile by manipulating URL
-    if username not in USERS:
+    user_data = USERS.get(username)
+    if user_data is None:
         flash(f"User '{username}' not found.", 'error')
         return redirect(url_for('index'))
     
-    user_data = USERS[username]
     is_own_profile = 'username' in session and session['username'] == username
     is_admin = 'username' in session and USERS.get(session['username'], {}).get('role') == 'admin'
     
@@ -1016,23 +3065,565 @@ def admin_users():
         flash("Access denied. Admin privileges required.", 'error')
         return redirect(url_for('index'))
     
+    after, limit = get_page_args(app.config['USER_PAGE_SIZE'], app.config['USER_MAX_PAGE_SIZE'])
+    page = USERS.page(after=after, limit=limit)
+    
     # VULNERABILITY: Showing all user data including passwords
-    users_list = "<ul>"
-    for username, data in USERS.items():
-        users_list += f"<li><strong>{escape(username)}</strong> ({escape(data['email'])}) - Role: {escape(data['role'])}, Password: {escape(data['password'])}</li>"
-    users_list += "</ul>"
+    users_list = "<ul>" + ''.join(
+        f"<li><strong>{escape(username)}</strong> ({escape(data['email'])}) - Role: {escape(data['role'])}, Password: {escape(data['password'])}</li>"
+        for username, data in page
+    ) + "</ul>"
+    
+    next_html = ""
+    if len(page) == limit:
+        next_html = f"<p><a href='{escape(url_for('admin_users', after=page[-1][0], limit=limit))}' class='btn btn-secondary'>Next Page</a></p>"
     
     admin_content = f'''
     <div class="card">
         <h3>User Management</h3>
         <p>Total users: {len(USERS)}</p>
         {users_list}
+        {next_html}
     </div>
     '''
     
     return render_page("Admin: User Management", admin_content)
 
+# --- Lab Snapshots ---
+# A snapshot is SNAPSHOT_FOLDER/<lab>/<name>/ holding users.ndjson and a hardlinked copy of the
+# upload folder, so taking and restoring one costs a directory walk rather than the file bytes.
+# That only works because uploads are written to a new file and renamed into place: an upload
+# never writes into an inode a snapshot shares.
+
+SNAPSHOT_NAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$')
+_snapshot_lock = threading.Lock()
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)  # Another filesystem, or one without hardlinks
+
+def get_snapshot_target(tenant_name=None):
+    """Returns (snapshot folder, user store, upload folder, entries to leave alone) of a lab."""
+    if tenant_name:
+        tenant = get_tenant_registry().get(tenant_name)
+        return os.path.join(app.config['SNAPSHOT_FOLDER'], tenant_name), tenant.users, tenant.upload_folder, ()
+    # Tenant names can't start with '_', and the tenants' own folders (and the objects every lab's uploads
+    # link to) aren't part of the default lab
+    return os.path.join(app.config['SNAPSHOT_FOLDER'], '_default'), DEFAULT_USERS, app.config['UPLOAD_FOLDER'], ('tenants', UPLOAD_OBJECTS_DIR)
+
+def create_snapshot(name, tenant_name=None):
+    """Saves the lab's users and uploads as snapshot `name`, replacing an older one of that name."""
+    if not SNAPSHOT_NAME_RE.match(name):
+        raise ValueError(f"Invalid snapshot name '{name}'")
+    folder, users, upload_folder, skip = get_snapshot_target(tenant_name)
+    path = os.path.join(folder, name)
+    staging = os.path.join(folder, f'.{name}.{uuid.uuid4().hex}')
+    start = time.perf_counter()
+    with _snapshot_lock:
+        os.makedirs(staging)
+        try:
+            with open(os.path.join(staging, 'users.ndjson'), 'w') as f:
+                for page in users.iter_pages():
+                    f.writelines(json.dumps([username, user]) + '\n' for username, user in page)
+            shutil.copytree(upload_folder, os.path.join(staging, 'uploads'), symlinks=True,
+                            copy_function=link_or_copy, ignore=lambda d, names: skip if d == upload_folder else ())
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.rename(staging, path)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+    return {'name': name, 'seconds': time.perf_counter() - start}
+
+def restore_snapshot(name, tenant_name=None):
+    """Puts the lab's users and uploads back the way snapshot `name` saw them. Returns None if there's no such snapshot."""
+    folder, users, upload_folder, skip = get_snapshot_target(tenant_name)
+    path = os.path.join(folder, name)
+    if not SNAPSHOT_NAME_RE.match(name) or not os.path.isdir(path):
+        return None
+    start = time.perf_counter()
+    with _snapshot_lock:
+        with open(os.path.join(path, 'users.ndjson')) as f:
+            users.replace_all(json.loads(line) for line in f)
+        for entry in os.scandir(upload_folder):
+            if entry.name in skip:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+        shutil.copytree(os.path.join(path, 'uploads'), upload_folder, symlinks=True,
+                        copy_function=link_or_copy, dirs_exist_ok=True)
+        # Restored uploads keep the mtimes they were snapshotted with, they count as uploaded now
+        record_upload_times(upload_folder, {entry.name for entry in iter_lab_uploads(upload_folder)}, time.time(),
+                            replace_all=True)
+    return {'name': name, 'seconds': time.perf_counter() - start}
+
+def delete_snapshot(name, tenant_name=None):
+    folder = get_snapshot_target(tenant_name)[0]
+    path = os.path.join(folder, name)
+    if not SNAPSHOT_NAME_RE.match(name) or not os.path.isdir(path):
+        return False
+    with _snapshot_lock:
+        shutil.rmtree(path)
+    return True
+
+def list_snapshots(tenant_name=None):
+    """Returns [{'name', 'created'}] of the lab's snapshots, newest first."""
+    folder = get_snapshot_target(tenant_name)[0]
+    if not os.path.isdir(folder):
+        return []
+    snapshots = [{'name': entry.name, 'created': entry.stat().st_mtime} for entry in os.scandir(folder)
+                 if entry.is_dir() and SNAPSHOT_NAME_RE.match(entry.name)]
+    return sorted(snapshots, key=lambda s: s['created'], reverse=True)
+
+@app.route('/admin/snapshots', methods=['GET', 'POST'])
+@app.route('/admin/snapshots/<name>/<action>', methods=['POST'])
+def admin_snapshots(name=None, action=None):
+    if 'username' not in session or USERS.get(session['username'], {}).get('role') != 'admin':
+        flash("Access denied. Admin privileges required.", 'error')
+        return redirect(url_for('index'))
+
+    tenant = get_tenant()
+    tenant_name = tenant.name if tenant else None
+    result, error = None, None
+    # VULNERABILITY: No CSRF protection on state-changing admin actions
+    if request.method == 'POST':
+        try:
+            if action is None:
+                result = create_snapshot(request.form.get('name', '').strip(), tenant_name)
+            elif action == 'restore':
+                result = restore_snapshot(name, tenant_name)
+                error = None if result else f"No snapshot named '{name}'."
+            elif action == 'delete':
+                result = {'name': name} if delete_snapshot(name, tenant_name) else None
+                error = None if result else f"No snapshot named '{name}'."
+            else:
+                error = f"Unknown action '{action}'."
+        except (ValueError, OSError) as e:
+            error = str(e)
+            print(f"Snapshot error: {e}") # Log real error
+        if wants_json():
+            if error:
+                return Response(json.dumps({'status': 'error', 'error': error}), status=400, mimetype='application/json')
+            return Response(json.dumps({'status': 'success', 'action': action or 'create', **result}), mimetype='application/json')
+        if error:
+            flash(error, 'error')
+        else:
+            flash(f"Snapshot '{result['name']}' {'created' if action is None else action + 'd'} in {result.get('seconds', 0) * 1000:.1f} ms.", 'success')
+        return redirect(url_for('admin_snapshots'))
+
+    snapshots = list_snapshots(tenant_name)
+    if wants_json():
+        return Response(json.dumps({'status': 'success', 'snapshots': snapshots}), mimetype='application/json')
+
+    messages_html = ''
+    if '_flashes' in session:
+        for category, message in session.pop('_flashes'):
+            messages_html += f'<div class="flash {category}">{escape(message)}</div>'
+    rows = ''.join(
+        f"""<li><strong>{escape(s['name'])}</strong> ({datetime.fromtimestamp(s['created']):%Y-%m-%d %H:%M:%S})
+        <form method="post" action="{escape(url_for('admin_snapshots', name=s['name'], action='restore'))}" style="display:inline"><input type="submit" value="Restore" class="btn"></form>
+        <form method="post" action="{escape(url_for('admin_snapshots', name=s['name'], action='delete'))}" style="display:inline"><input type="submit" value="Delete" class="btn btn-secondary"></form></li>"""
+        for s in snapshots
+    )
+    snapshot_content = f'''
+    <div class="card">
+        <h3>Lab Snapshots</h3>
+        <p>A snapshot saves every user account and uploaded design. Restoring one puts the lab back exactly as it was.</p>
+        <form method="post">
+            <div class="form-group">
+                <label for="name">Snapshot name:</label>
+                <input type="text" id="name" name="name" required pattern="[A-Za-z0-9][A-Za-z0-9._\\-]{{0,63}}">
+            </div>
+            <input type="submit" value="Take Snapshot" class="btn">
+        </form>
+        <ul>{rows or '<li>No snapshots yet.</li>'}</ul>
+    </div>
+    '''
+    return render_page("Admin: Lab Snapshots", messages_html + snapshot_content)
+
+@app.cli.group()
+def snapshot():
+    """Snapshot and restore a lab's users and uploads.
+
+    With USER_STORE=memory the users live in the server process, use
+    /admin/snapshots there. Uploads (and sqlite users) work from here.
+    """
+
+def validate_tenant_option(ctx, param, value):
+    if value is not None and not TENANT_NAME_RE.match(value):
+        raise click.BadParameter("lowercase letters, digits and '-', up to 63 characters")
+    return value
+
+@snapshot.command('create')
+@click.argument('name')
+@click.option('--tenant', callback=validate_tenant_option, help="Lab to snapshot in tenant mode, default the single lab.")
+def snapshot_create_command(name, tenant):
+    result = create_snapshot(name, tenant)
+    click.echo(f"Created snapshot '{name}' in {result['seconds'] * 1000:.1f} ms")
+
+@snapshot.command('restore')
+@click.argument('name')
+@click.option('--tenant', callback=validate_tenant_option, help="Lab to restore in tenant mode, default the single lab.")
+def snapshot_restore_command(name, tenant):
+    result = restore_snapshot(name, tenant)
+    if result is None:
+        raise click.ClickException(f"No snapshot named '{name}'")
+    click.echo(f"Restored snapshot '{name}' in {result['seconds'] * 1000:.1f} ms")
+
+@snapshot.command('delete')
+@click.argument('name')
+@click.option('--tenant', callback=validate_tenant_option, help="Lab the snapshot belongs to in tenant mode.")
+def snapshot_delete_command(name, tenant):
+    if not delete_snapshot(name, tenant):
+        raise click.ClickException(f"No snapshot named '{name}'")
+    click.echo(f"Deleted snapshot '{name}'")
+
+@snapshot.command('list')
+@click.option('--tenant', callback=validate_tenant_option, help="Lab to list in tenant mode, default the single lab.")
+def snapshot_list_command(tenant):
+    for s in list_snapshots(tenant):
+        click.echo(f"{s['name']}\t{datetime.fromtimestamp(s['created']):%Y-%m-%d %H:%M:%S}")
+
+# --- Supplier Fetcher ---
+
+class SupplierFetcher:
+    """Fetches the start of supplier pages over pooled keep-alive connections.
+
+    Reads stop once enough text for the preview has arrived, successful responses are
+    cached (LRU + TTL) and concurrent requests for the same URL share one fetch. Like urllib,
+    requests go through the proxies in HTTP_PROXY / HTTPS_PROXY unless NO_PROXY names the host.
+    """
+
+    REDIRECT_CODES = {301, 302, 303, 307, 308}
+    MAX_REDIRECTS = 5
+    CHUNK_SIZE = 4096
+
+    def __init__(self, connect_timeout=3.0, read_timeout=10.0, max_chars=1000, pool_size=4,
+                 cache_size=256, cache_ttl=60):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_chars = max_chars
+        self.pool_size = pool_size
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.single_flight = SingleFlight()
+        self._pool = {}  # (scheme, host, port, proxy) -> idle connections
+        self._pool_lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+        self.proxies = getproxies()
+        self.pid = os.getpid()
+
+    def fetch(self, url):
+        """Returns {'url', 'status', 'content', 'truncated'} for url, from cache when possible."""
+        result = self.cache.get(url)
+        if result is not None:
+            return result
+        return self.single_flight.do(url, lambda: self._fetch_and_cache(url))
+
+    def _fetch_and_cache(self, url):
+        result = self._fetch(url)
+        self.cache.put(url, result)
+        return result
+
+    def _fetch(self, url):
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                # file:, ftp:, data: and friends still go through urllib
+                with urlopen(url, timeout=self.read_timeout) as response:
+                    content, truncated = self._read_preview(response)
+                return {'url': url, 'status': getattr(response, 'status', None), 'content': content, 'truncated': truncated}
+
+            if not parts.hostname:
+                raise URLError(f"no host given in {url!r}")
+            status, location, content, truncated = self._request(parts)
+            if status in self.REDIRECT_CODES and location:
+                url = urljoin(url, location)
+                continue
+            if status >= 400:
+                raise HTTPError(url, status, http.client.responses.get(status, ''), None, None)
+            return {'url': url, 'status': status, 'content': content, 'truncated': truncated}
+        raise HTTPError(url, status, 'Too many redirects', None, None)
+
+    def _proxy_for(self, parts):
+        """Returns (host, port, Proxy-Authorization header or None) of the proxy to use for parts, or None."""
+        proxy = self.proxies.get(parts.scheme)
+        if not proxy or proxy_bypass(parts.hostname):
+            return None
+        proxy_parts = urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+        auth = None
+        if proxy_parts.username is not None:
+            credentials = f'{unquote(proxy_parts.username)}:{unquote(proxy_parts.password or "")}'
+            auth = 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+        return proxy_parts.hostname, proxy_parts.port, auth
+
+    def _request(self, parts):
+        proxy = self._proxy_for(parts)
+        key = (parts.scheme, parts.hostname, parts.port, proxy)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = {'User-Agent': 'TrendyTees-SupplierCheck/1.0', 'Accept-Encoding': 'identity'}
+        if proxy is not None and parts.scheme == 'http':
+            # Plain HTTP goes to the proxy as an absolute URI, HTTPS is tunnelled (see _connect)
+            path = f"http://{parts.netloc.rpartition('@')[2]}{path}"
+            if proxy[2]:
+                headers['Proxy-Authorization'] = proxy[2]
+
+        conn = self._checkout(key)
+        reused = conn is not None
+        for attempt in range(2):
+            if conn is None:
+                conn = self._connect(key)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                conn = None
+                if not reused or attempt:
+                    raise
+                # The server dropped an idle pooled connection, retry once on a fresh one
+        try:
+            location = response.getheader('Location')
+            content, truncated = self._read_preview(response)
+        except Exception:
+            conn.close()
+            raise
+        if response.isclosed() and not response.will_close:
+            self._checkin(key, conn)
+        else:
+            # Body left unread or server wants to close, the connection can't be reused
+            conn.close()
+        return response.status, location, content, truncated
+
+    def _connect(self, key):
+        scheme, host, port, proxy = key
+        connect_host, connect_port = (host, port) if proxy is None else proxy[:2]
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(connect_host, connect_port, timeout=self.connect_timeout, context=self._ssl_context)
+            if proxy is not None:
+                conn.set_tunnel(host, port, headers={'Proxy-Authorization': proxy[2]} if proxy[2] else None)
+        else:
+            conn = http.client.HTTPConnection(connect_host, connect_port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def _checkout(self, key):
+        with self._pool_lock:
+            idle = self._pool.get(key)
+            return idle.pop() if idle else None
+
+    def _checkin(self, key, conn):
+        with self._pool_lock:
+            idle = self._pool.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _read_preview(self, response):
+        """Reads just enough of the body to fill the preview. Returns (text, truncated)."""
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        parts = []
+        length = 0
+        while length <= self.max_chars:
+            chunk = response.read(self.CHUNK_SIZE)
+            if not chunk:
+                text = decoder.decode(b'', final=True)
+                parts.append(text)
+                length += len(text)
+                break
+            text = decoder.decode(chunk)
+            parts.append(text)
+            length += len(text)
+        content = ''.join(parts)
+        return content[:self.max_chars], len(content) > self.max_chars
+
+_supplier_fetcher = None
+
+def get_supplier_fetcher():
+    """Returns this process's supplier fetcher, created on first use so forked workers don't share sockets."""
+    global _supplier_fetcher
+    if _supplier_fetcher is None or _supplier_fetcher.pid != os.getpid():
+        _supplier_fetcher = SupplierFetcher(
+            connect_timeout=app.config['SUPPLIER_CONNECT_TIMEOUT'],
+            read_timeout=app.config['SUPPLIER_READ_TIMEOUT'],
+            max_chars=app.config['SUPPLIER_PREVIEW_CHARS'],
+            pool_size=app.config['SUPPLIER_POOL_SIZE'],
+            cache_size=app.config['SUPPLIER_CACHE_SIZE'],
+            cache_ttl=app.config['SUPPLIER_CACHE_TTL'],
+        )
+    return _supplier_fetcher
+
+# --- Batch Supplier Checks ---
+
+_supplier_batch_executor = None
+_supplier_check_queue = None
+
+def get_supplier_batch_executor():
+    """Returns the shared pool batch checks run on; its size is the process-wide concurrency cap."""
+    global _supplier_batch_executor
+    if _supplier_batch_executor is None:
+        _supplier_batch_executor = ThreadPoolExecutor(max_workers=app.config['SUPPLIER_BATCH_CONCURRENCY'],
+                                                      thread_name_prefix='supplier-check')
+    return _supplier_batch_executor
+
+class SupplierCheckQueue:
+    """Queues batch checks per host, handing them to the shared pool as that host's slots free up.
+
+    A check only takes a pool thread once fewer than SUPPLIER_BATCH_PER_HOST checks are running
+    against its host, so a slow host's backlog waits in its own queue instead of holding threads
+    every other host's checks need. Returns a Future per check, its `started` is set once it runs.
+    """
+
+    def __init__(self, executor, per_host):
+        self.executor = executor
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._queues = {}  # host -> deque of futures waiting for a slot
+        self._running = {}  # host -> checks running against it
+
+    def submit(self, url):
+        future = Future()
+        future.url = url
+        future.started = None
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if self._running.get(host, 0) >= self.per_host:
+                self._queues.setdefault(host, deque()).append(future)
+                return future
+            self._running[host] = self._running.get(host, 0) + 1
+        self.executor.submit(self._run, host, future)
+        return future
+
+    def _run(self, host, future):
+        try:
+            if future.set_running_or_notify_cancel():
+                future.started = time.monotonic()
+                try:
+                    future.set_result(check_supplier_url(future.url))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            self._next(host)
+
+    def _next(self, host):
+        with self._lock:
+            queue = self._queues.get(host)
+            while queue and queue[0].cancelled():
+                queue.popleft()  # Its batch is over
+            if not queue:
+                self._queues.pop(host, None)
+                self._running[host] -= 1
+                if not self._running[host]:
+                    del self._running[host]
+                return
+            future = queue.popleft()
+        self.executor.submit(self._run, host, future)  # Takes over the slot of the check that just ended
+
+def get_supplier_check_queue():
+    global _supplier_check_queue
+    if _supplier_check_queue is None:
+        _supplier_check_queue = SupplierCheckQueue(get_supplier_batch_executor(), app.config['SUPPLIER_BATCH_PER_HOST'])
+    return _supplier_check_queue
+
+def check_supplier_url(url):
+    """Worker body for one batch entry. Returns the result record (without the index and timings)."""
+    record = {'url': url, 'ok': False}
+    try:
+        fetched = get_supplier_fetcher().fetch(url)
+        record.update(ok=True, status=fetched['status'], final_url=fetched['url'],
+                      preview_chars=len(fetched['content']), truncated=fetched['truncated'])
+    except Exception as e:
+        record['error'] = str(e)
+    return record
+
+def iter_supplier_batch(urls):
+    """Runs the checks concurrently and yields NDJSON lines in completion order."""
+    queue = get_supplier_check_queue()
+    deadline_seconds = app.config['SUPPLIER_BATCH_DEADLINE']
+    pending = {}
+    for index, url in enumerate(urls):
+        pending[queue.submit(url)] = (index, url, time.monotonic())
+
+    def timings(future, submitted, now):
+        queued = (future.started if future.started is not None else now) - submitted
+        return {'queued_ms': round(queued * 1000, 1), 'elapsed_ms': round((now - submitted) * 1000, 1)}
+
+    try:
+        while pending:
+            # A check's deadline runs from when it starts; one still queued can't time out before
+            # deadline_seconds from now, look again by then
+            now = time.monotonic()
+            next_deadline = min((future.started if future.started is not None else now) + deadline_seconds
+                                for future in pending)
+            done, _ = wait(pending, timeout=max(0.0, next_deadline - now), return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in done:
+                index, url, submitted = pending.pop(future)
+                yield json.dumps({'index': index, **future.result(), **timings(future, submitted, now)}) + '\n'
+
+            for future, (index, url, submitted) in list(pending.items()):
+                started = future.started
+                if started is not None and now >= started + deadline_seconds:
+                    # Report it now; the fetch in flight still ends at the fetcher's read timeout
+                    del pending[future]
+                    yield json.dumps({'index': index, 'url': url, 'ok': False, 'error': 'deadline exceeded',
+                                      **timings(future, submitted, now)}) + '\n'
+    finally:
+        # Client went away or we are done, don't start checks nobody will read
+        for future in pending:
+            future.cancel()
+
+@app.route('/check-supplier/batch', methods=['POST'])
+def check_supplier_batch():
+    # Accepts a JSON list of URLs (or {"urls": [...]}) and streams one NDJSON result per URL
+    payload = request.get_json(silent=True)
+    urls = payload.get('urls') if isinstance(payload, dict) else payload
+    if not isinstance(urls, list) or not all(isinstance(url, str) and url for url in urls):
+        return Response(json.dumps({'status': 'error', 'error': 'Expected a JSON list of URLs'}), status=400, mimetype='application/json')
+    if len(urls) > app.config['SUPPLIER_BATCH_MAX_URLS']:
+        return Response(json.dumps({'status': 'error', 'error': f"At most {app.config['SUPPLIER_BATCH_MAX_URLS']} URLs per batch"}),
+                        status=413, mimetype='application/json')
+    
+    # VULNERABILITY: Same SSRF as the single check, just many at a time
+    return Response(iter_supplier_batch(urls), mimetype='application/x-ndjson')
+
 # VULNERABILITY: SSRF (Server-Side Request Forgery)
+def iter_supplier_check_html(supplier_url):
+    """Yields the /check-supplier result once the supplier has answered."""
+    try:
+        # VULNERABILITY: Direct use of user input in URL request
+        fetched = get_supplier_fetcher().fetch(supplier_url)
+        content = fetched['content']
+        
+        # Limit content length for display, the fetcher stopped reading at the limit
+        if fetched['truncated']:
+            content = content + "... [Content truncated]"
+        
+        yield f"""
+        <div class="card">
+            <h3>Supplier Verification Result</h3>
+            <p><strong>URL:</strong> {escape(supplier_url)}</p>
+            <p><strong>Status:</strong> Valid supplier</p>
+            <h4>Response Preview:</h4>
+            <pre>{escape(content)}</pre>
+        </div>
+        <p><a href="/check-supplier" class="btn btn-secondary">Check Another</a></p>
+        """
+    except Exception as e:
+        print(f"Supplier check error: {e}") # Log real error
+        yield f"""
+        <p class='flash error'>Error verifying supplier: {str(e)}</p>
+        <p><a href="/check-supplier" class="btn btn-secondary">Try Again</a></p>
+        """
+
 @app.route('/check-supplier', methods=['GET', 'POST'])
 def check_supplier():
     title = "Supplier Verification"
@@ -1043,33 +3634,8 @@ def check_supplier():
         if not supplier_url:
             return render_page(title, "<p class='flash error'>Supplier URL is required</p>")
         
-        try:
-            # VULNERABILITY: Direct use of user input in URL request
-            response = urlopen(supplier_url)
-            content = response.read().decode('utf-8')
-            
-            # Limit content length for display
-            if len(content) > 1000:
-                content = content[:1000] + "... [Content truncated]"
-            
-            result = f"""
-            <div class="card">
-                <h3>Supplier Verification Result</h3>
-                <p><strong>URL:</strong> {escape(supplier_url)}</p>
-                <p><strong>Status:</strong> Valid supplier</p>
-                <h4>Response Preview:</h4>
-                <pre>{escape(content)}</pre>
-            </div>
-            <p><a href="/check-supplier" class="btn btn-secondary">Check Another</a></p>
-            """
-            
-            return render_page(title, result)
-        except Exception as e:
-            error_msg = f"""
-            <p class='flash error'>Error verifying supplier: {str(e)}</p>
-            <p><a href="/check-supplier" class="btn btn-secondary">Try Again</a></p>
-            """
-            return render_page(title, error_msg)
+        # The page shell goes out before the supplier is contacted
+        return stream_page(title, iter_supplier_check_html(supplier_url))
     
     # GET request - show form
     form = """
@@ -1087,70 +3653,323 @@ def check_supplier():
     </div>
     """
     
-    return render_page(title, form)
+    return static_page(lambda: render_page(title, form))
+
+def iter_catalog_products(source):
+    """Yields name/sku/price dicts from an XML catalog, one <product> at a time.
+
+    Parses incrementally with iterparse and throws each product element away once
+    its fields are read, so memory stays flat no matter how big the catalog is.
+    """
+    stack = []
+    open_products = 0
+    # VULNERABILITY: Parsing XML without disabling external entities
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            if elem.tag == 'product':
+                open_products += 1
+            continue
+
+        stack.pop()
+        if elem.tag != 'product':
+            continue
+        open_products -= 1
+        if not stack:
+            # Root element itself, './/product' never matched it either
+            continue
+
+        yield {
+            'name': elem.findtext('name') or 'Unknown',
+            'sku': elem.findtext('sku') or 'Unknown',
+            'price': elem.findtext('price') or '$0.00'
+        }
+        elem.clear()
+        if not open_products:
+            # Nothing still being parsed depends on the siblings, drop the emptied shells too
+            del stack[-1][:]
+
+def read_upload_head(stream, limit=4096):
+    """Returns the first bytes of an uploaded file as text, for error pages."""
+    try:
+        stream.seek(0)
+        return stream.read(limit).decode('utf-8', errors='replace')
+    except Exception:
+        return 'Unable to read XML'
+
+# --- Catalog Store ---
+
+# Every lab has its own products table in the one catalog database, like it has its own users table
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    sku TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    price TEXT NOT NULL,
+    imported_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS {table}_name_sku ON {table} (name, sku);
+"""
+_catalog_schema_ready = set()
+
+def get_catalog_table():
+    """Returns the current lab's products table: products, or products_<tenant> in tenant mode."""
+    tenant = get_tenant()
+    return 'products' if tenant is None else tenant.catalog_table
+
+def get_catalog_db(table='products'):
+    """Returns a connection to the product catalog, creating table (and the import jobs table) on first use."""
+    path = app.config['CATALOG_DB_PATH']
+    db = get_db(path)
+    if (path, table) not in _catalog_schema_ready:
+        db.executescript(CATALOG_SCHEMA.format(table=table) + CATALOG_JOBS_SCHEMA)
+        _catalog_schema_ready.add((path, table))
+    return db
+
+def write_catalog_batch(db, insert, batch):
+    """Writes a batch of product rows in one transaction, with insert (one statement, prepared once) run over all of them."""
+    db.execute('BEGIN')
+    try:
+        db.executemany(insert, batch)
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+def save_catalog_products(products, table=None):
+    """Passes products through unchanged while writing them to table (the current lab's) in batches.
+
+    Every product passed on is saved, also when the import stops early (the consumer closes the
+    generator, the client goes away): the last partial batch is committed on the way out.
+    """
+    table = table or get_catalog_table()
+    db = get_catalog_db(table)
+    insert = f'INSERT OR REPLACE INTO {table} (sku, name, price, imported_at) VALUES (?, ?, ?, ?)'
+    batch_size = app.config['CATALOG_INSERT_BATCH']
+    imported_at = time.time()
+    batch = []
+    try:
+        for product in products:
+            batch.append((product['sku'], product['name'], product['price'], imported_at))
+            if len(batch) >= batch_size:
+                full, batch = batch, []
+                write_catalog_batch(db, insert, full)
+            yield product
+    finally:
+        if batch:
+            write_catalog_batch(db, insert, batch)
+
+def get_catalog_product(sku):
+    table = get_catalog_table()
+    row = get_catalog_db(table).execute(f'SELECT sku, name, price FROM {table} WHERE sku = ?', (sku,)).fetchone()
+    if row is None:
+        return None
+    return {'sku': row[0], 'name': row[1], 'price': row[2]}
+
+def list_catalog_products(after=None, limit=50, name=None):
+    """Returns (products, next_cursor) for one keyset page ordered by SKU, optionally for one name."""
+    table = get_catalog_table()
+    query = f'SELECT sku, name, price FROM {table}'
+    clauses, params = [], []
+    if name is not None:
+        clauses.append('name = ?')
+        params.append(name)
+    if after is not None:
+        clauses.append('sku > ?')
+        params.append(after)
+    if clauses:
+        query += ' WHERE ' + ' AND '.join(clauses)
+    query += ' ORDER BY sku LIMIT ?'
+    params.append(limit + 1)  # One extra row tells us whether there is a next page
+
+    rows = get_catalog_db(table).execute(query, params).fetchall()
+    products = [{'sku': sku, 'name': pname, 'price': price} for sku, pname, price in rows[:limit]]
+    next_cursor = products[-1]['sku'] if len(rows) > limit else None
+    return products, next_cursor
+
+def product_row_html(product):
+    return f"<tr><td>{escape(product['name'])}</td><td>{escape(product['sku'])}</td><td>{escape(product['price'])}</td></tr>"
+
+# --- Background Catalog Imports ---
+# Job rows live in the catalog database next to the products, so any worker process can
+# answer a poll for an import another one is running
+
+CATALOG_JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog_jobs (
+    id TEXT PRIMARY KEY,
+    tenant TEXT NOT NULL,
+    status TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    products_parsed INTEGER NOT NULL DEFAULT 0,
+    preview TEXT,
+    error TEXT,
+    pid INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS catalog_jobs_finished_at ON catalog_jobs (finished_at);
+"""
+CATALOG_JOB_FIELDS = ('id', 'tenant', 'status', 'filename', 'products_parsed', 'preview', 'error', 'pid',
+                      'created_at', 'started_at', 'finished_at')
+CATALOG_JOBS_LOCK = threading.Lock()  # Counting this process's pending jobs and adding one is a single step
+_catalog_executor = None
+
+def get_catalog_executor():
+    """Returns the import thread pool, created on first use so forked workers get their own."""
+    global _catalog_executor
+    if _catalog_executor is None:
+        _catalog_executor = ThreadPoolExecutor(max_workers=app.config['CATALOG_IMPORT_WORKERS'],
+                                               thread_name_prefix='catalog-import')
+    return _catalog_executor
+
+def get_catalog_job_tenant():
+    """Returns the tenant name jobs of the current lab are stored under, '' outside tenant mode."""
+    tenant = get_tenant()
+    return '' if tenant is None else tenant.name
+
+def get_catalog_job(job_id):
+    """Returns the current lab's job as a dict, or None if it has no such job (or it expired).
+
+    A job still queued or running in a process that's gone (a recycled or crashed worker,
+    or a previous run of the server) never finishes, so it's marked failed here.
+    """
+    db = get_catalog_db()
+    row = db.execute(f"SELECT {', '.join(CATALOG_JOB_FIELDS)} FROM catalog_jobs WHERE id = ? AND tenant = ?",
+                     (job_id, get_catalog_job_tenant())).fetchone()
+    if row is None:
+        return None
+    job = dict(zip(CATALOG_JOB_FIELDS, row))
+    if job['status'] in ('queued', 'running') and job['pid'] != os.getpid() and not process_alive(job['pid']):
+        job.update(status='failed', error='The worker running this import exited before it finished',
+                   finished_at=time.time())
+        db.execute("UPDATE catalog_jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+                   (job['status'], job['error'], job['finished_at'], job_id))
+    return job
+
+def update_catalog_job(job_id, **fields):
+    get_catalog_db().execute(f"UPDATE catalog_jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                             (*fields.values(), job_id))
+
+def catalog_job_view(job):
+    """Returns the JSON-friendly status of an import job."""
+    started = job['started_at']
+    finished = job['finished_at'] or time.time()
+    elapsed = finished - started if started else 0.0
+    view = {
+        'id': job['id'],
+        'status': job['status'],
+        'filename': job['filename'],
+        'products_parsed': job['products_parsed'],
+        'elapsed_seconds': round(elapsed, 3),
+        'products_per_second': round(job['products_parsed'] / elapsed, 1) if elapsed else 0.0,
+    }
+    if job['status'] == 'done':
+        view['result'] = {'count': job['products_parsed'], 'products': json.loads(job['preview'])}
+    elif job['status'] == 'failed':
+        view['error'] = job['error']
+    return view
+
+def run_catalog_import_job(job_id, spool_path, table):
+    """Worker body: parses the spooled catalog into table, recording progress on the job's row after every insert batch."""
+    preview_rows = app.config['CATALOG_PREVIEW_ROWS']
+    progress_every = app.config['CATALOG_INSERT_BATCH']
+    preview = []
+    count = 0
+    try:
+        update_catalog_job(job_id, status='running', started_at=time.time())
+        with open(spool_path, 'rb') as f:
+            for product in save_catalog_products(iter_catalog_products(f), table):
+                if len(preview) < preview_rows:
+                    preview.append(product)
+                count += 1
+                if count % progress_every == 0:
+                    update_catalog_job(job_id, products_parsed=count)
+        update_catalog_job(job_id, status='done', products_parsed=count, preview=json.dumps(preview),
+                           finished_at=time.time())
+    except Exception as e:
+        print(f"Catalog import job {job_id} error: {e}") # Log real error
+        update_catalog_job(job_id, status='failed', products_parsed=count, error=str(e), finished_at=time.time())
+    finally:
+        try:
+            os.remove(spool_path)
+        except OSError:
+            pass
+
+def submit_catalog_import(xml_file):
+    """Spools an uploaded catalog to disk and queues it. Returns the job, or None when the queue is full."""
+    db = get_catalog_db()
+    now = time.time()
+    # Finished jobs can be polled until CATALOG_JOB_TTL runs out
+    db.execute('DELETE FROM catalog_jobs WHERE finished_at < ?', (now - app.config['CATALOG_JOB_TTL'],))
+    job_id = uuid.uuid4().hex
+    with CATALOG_JOBS_LOCK:
+        # The limit is per process, it's this process's import threads the jobs queue for
+        pending = db.execute("SELECT COUNT(*) FROM catalog_jobs WHERE pid = ? AND status IN ('queued', 'running')",
+                             (os.getpid(),)).fetchone()[0]
+        if pending >= app.config['CATALOG_IMPORT_MAX_PENDING']:
+            return None
+        db.execute("INSERT INTO catalog_jobs (id, tenant, status, filename, pid, created_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                   (job_id, get_catalog_job_tenant(), xml_file.filename, os.getpid(), now))
+
+    try:
+        spool_folder = app.config['CATALOG_SPOOL_FOLDER']
+        os.makedirs(spool_folder, exist_ok=True)
+        fd, spool_path = tempfile.mkstemp(suffix='.xml', dir=spool_folder)
+        with os.fdopen(fd, 'wb') as spool:
+            xml_file.save(spool)
+        # The import thread has no request, so it's told which lab's table to fill
+        get_catalog_executor().submit(run_catalog_import_job, job_id, spool_path, get_catalog_table())
+    except Exception as e:
+        update_catalog_job(job_id, status='failed', error=str(e), finished_at=time.time())
+    return get_catalog_job(job_id)
 
 # VULNERABILITY: XML External Entity (XXE) Injection
-@app.route('/import-catalog', methods=['GET', 'POST'])
-def import_catalog():
-    title = "Import Product Catalog"
-    
-    if request.method == 'POST':
-        if 'xml_file' not in request.files:
-            return render_page(title, "<p class='flash error'>No file part</p>")
-            
-        xml_file = request.files['xml_file']
-        
-        if xml_file.filename == '':
-            return render_page(title, "<p class='flash error'>No file selected</p>")
-            
-        if xml_file:
-            try:
-                # Read the XML content
-                xml_content = xml_file.read().decode('utf-8')
-                
-                # VULNERABILITY: Parsing XML without disabling external entities
-                tree = ET.fromstring(xml_content)
-                
-                # Extract product data (simplified)
-                products = []
-                for product in tree.findall('.//product'):
-                    product_data = {
-                        'name': product.findtext('name') or 'Unknown',
-                        'sku': product.findtext('sku') or 'Unknown',
-                        'price': product.findtext('price') or '$0.00'
-                    }
-                    products.append(product_data)
-                
-                # Display the imported products
-                products_html = "<table border='1' style='width:100%; border-collapse: collapse;'>"
-                products_html += "<tr><th>Name</th><th>SKU</th><th>Price</th></tr>"
-                
-                for product in products:
-                    products_html += f"<tr><td>{escape(product['name'])}</td><td>{escape(product['sku'])}</td><td>{escape(product['price'])}</td></tr>"
-                
-                products_html += "</table>"
-                
-                result = f"""
-                <div class="card">
-                    <h3>Catalog Import Successful</h3>
-                    <p>{len(products)} products imported.</p>
-                    {products_html}
-                </div>
-                <p><a href="/import-catalog" class="btn btn-secondary">Import Another Catalog</a></p>
-                """
-                
-                return render_page(title, result)
-            except Exception as e:
-                # VULNERABILITY: Detailed error exposure
-                error_msg = f"""
-                <p class='flash error'>Error parsing XML: {str(e)}</p>
-                <pre>{escape(xml_content if 'xml_content' in locals() else 'Unable to read XML')}</pre>
-                <p><a href="/import-catalog" class="btn btn-secondary">Try Again</a></p>
-                """
-                return render_page(title, error_msg)
-    
-    # GET request - show form
-    form = """
+def iter_catalog_import_html(xml_stream, chunk_rows=100):
+    """Yields the import result while the upload is parsed and stored, preview rows in chunks of chunk_rows.
+
+    xml_stream is a copy of the upload that outlives the request, closed when it's done.
+    """
+    preview_rows = app.config['CATALOG_PREVIEW_ROWS']
+    yield """
+    <div class="card">
+        <h3>Catalog Import</h3>
+        <table border='1' style='width:100%; border-collapse: collapse;'>
+        <tr><th>Name</th><th>SKU</th><th>Price</th></tr>"""
+    rows = []
+    count = 0
+    try:
+        # Stream products straight off the upload, only the first rows are shown
+        for product in save_catalog_products(iter_catalog_products(xml_stream)):
+            if count < preview_rows:
+                rows.append(product_row_html(product))
+                if len(rows) == chunk_rows:
+                    yield ''.join(rows)
+                    rows = []
+            count += 1
+    except Exception as e:
+        # The 200 and the page shell are out already, the page is the only place left to say so
+        print(f"Catalog import error: {e}") # Log real error
+        # VULNERABILITY: Detailed error exposure
+        yield ''.join(rows) + f"""</table>
+    </div>
+    <p class='flash error'>Error parsing XML: {str(e)}</p>
+    <pre>{escape(read_upload_head(xml_stream))}</pre>
+    <p><a href="/import-catalog" class="btn btn-secondary">Try Again</a></p>
+    """
+        return
+    finally:
+        xml_stream.close()
+
+    summary = f"<p><small>Showing the first {preview_rows} of {count} products.</small></p>" if count > preview_rows else ""
+    yield ''.join(rows) + f"""</table>
+        {summary}
+        <p class='flash success'>Catalog Import Successful: {count} products imported.</p>
+    </div>
+    <p><a href="/catalog" class="btn">Browse Catalog</a> <a href="/import-catalog" class="btn btn-secondary">Import Another Catalog</a></p>
+    """
+
+# Form shown by GET /import-catalog
+IMPORT_CATALOG_FORM_HTML = minify_html("""
     <div class="card">
         <h3>Import Product Catalog</h3>
         <p>Upload an XML file containing product information.</p>
@@ -1159,6 +3978,9 @@ def import_catalog():
                 <label for="xml_file">XML Catalog File:</label>
                 <input type="file" id="xml_file" name="xml_file" accept=".xml" required>
             </div>
+            <div class="form-group">
+                <label><input type="checkbox" name="async" value="1"> Import in the background (large catalogs)</label>
+            </div>
             <input type="submit" value="Import Catalog" class="btn">
         </form>
         <h4>Sample XML Format:</h4>
@@ -1175,9 +3997,123 @@ def import_catalog():
   &lt;/product&gt;
 &lt;/catalog&gt;</pre>
     </div>
-    """
+    """)
+
+@app.route('/import-catalog', methods=['GET', 'POST'])
+def import_catalog():
+    title = "Import Product Catalog"
+    
+    if request.method == 'POST':
+        if 'xml_file' not in request.files:
+            return render_page(title, "<p class='flash error'>No file part</p>")
+            
+        xml_file = request.files['xml_file']
+        
+        if xml_file.filename == '':
+            return render_page(title, "<p class='flash error'>No file selected</p>")
+            
+        if xml_file and (request.form.get('async') or request.args.get('async')):
+            # Opt-in background mode: hand the catalog to a worker and answer right away
+            job = submit_catalog_import(xml_file)
+            if job is None:
+                if wants_json():
+                    return Response(json.dumps({'status': 'busy'}), status=503, mimetype='application/json')
+                return render_page(title, "<p class='flash error'>Too many imports in progress, please try again shortly.</p>"), 503
+            status_url = url_for('catalog_import_job', job_id=job['id'])
+            if wants_json():
+                response = Response(json.dumps({'job_id': job['id'], 'status': job['status'], 'status_url': status_url}),
+                                    status=202, mimetype='application/json')
+                response.headers['Location'] = status_url
+                return response
+            result = f"""
+            <div class="card">
+                <h3>Catalog Import Queued</h3>
+                <p>Your catalog is being imported in the background.</p>
+                <p>Job ID: <code>{escape(job['id'])}</code></p>
+                <p><a href="{status_url}">Check import progress</a></p>
+            </div>
+            <p><a href="/import-catalog" class="btn btn-secondary">Import Another Catalog</a></p>
+            """
+            return render_page(title, result), 202
+
+        if xml_file:
+            # The request closes its files once the view returns, before a streamed body is produced,
+            # so the page generator gets its own copy of the upload (in memory unless it's large)
+            xml_stream = tempfile.SpooledTemporaryFile(max_size=app.config['CATALOG_SPOOL_MEMORY'])
+            xml_file.save(xml_stream)
+            xml_stream.seek(0)
+            # The page shell goes out right away, preview rows follow as products are stored
+            return stream_page(title, iter_catalog_import_html(xml_stream))
     
-    return render_page(title, form)
+    # GET request - show form
+    return static_page(lambda: render_page(title, IMPORT_CATALOG_FORM_HTML))
+
+@app.route('/import-catalog/jobs/<job_id>')
+def catalog_import_job(job_id):
+    job = get_catalog_job(job_id)
+    if job is None:
+        return Response(json.dumps({'status': 'unknown', 'id': job_id}), status=404, mimetype='application/json')
+    return Response(json.dumps(catalog_job_view(job)), mimetype='application/json')
+
+@app.route('/catalog')
+def catalog():
+    title = "Product Catalog"
+    after, limit = get_page_args(app.config['CATALOG_PAGE_SIZE'], app.config['CATALOG_MAX_PAGE_SIZE'])
+    name = request.args.get('name') or None
+
+    products, next_cursor = list_catalog_products(after=after, limit=limit, name=name)
+
+    if request.args.get('format') == 'json':
+        return Response(json.dumps({'products': products, 'next': next_cursor}), mimetype='application/json')
+
+    if products:
+        products_html = "<table border='1' style='width:100%; border-collapse: collapse;'>"
+        products_html += "<tr><th>Name</th><th>SKU</th><th>Price</th></tr>"
+        products_html += ''.join(product_row_html(product) for product in products)
+        products_html += "</table>"
+    else:
+        products_html = "<p class='flash info'>No products found. Import a catalog to get started.</p>"
+
+    next_html = ""
+    if next_cursor is not None:
+        next_args = {'after': next_cursor, 'limit': limit}
+        if name is not None:
+            next_args['name'] = name
+        next_html = f'<a href="{escape(url_for("catalog", **next_args))}" class="btn btn-secondary">Next Page</a>'
+
+    content = f"""
+    <div class="card">
+        <h3>Imported Products</h3>
+        {products_html}
+    </div>
+    <p>{next_html} <a href="/catalog" class="btn btn-secondary">First Page</a> <a href="/import-catalog" class="btn">Import Catalog</a></p>
+    """
+    return render_page(title, content)
+
+@app.route('/catalog/<path:sku>')
+def catalog_product(sku):
+    product = get_catalog_product(sku)
+    if request.args.get('format') == 'json':
+        if product is None:
+            return Response(json.dumps({'status': 'not_found', 'sku': sku}), status=404, mimetype='application/json')
+        return Response(json.dumps(product), mimetype='application/json')
+
+    if product is None:
+        return render_page("Product Not Found", f"<p class='flash error'>No product with SKU '{escape(sku)}'.</p>"), 404
+    content = f"""
+    <div class="card">
+        <h3>{escape(product['name'])}</h3>
+        <dl class="profile-info">
+            <dt>SKU:</dt>
+            <dd>{escape(product['sku'])}</dd>
+
+            <dt>Price:</dt>
+            <dd>{escape(product['price'])}</dd>
+        </dl>
+    </div>
+    <p><a href="/catalog" class="btn btn-secondary">Back to Catalog</a></p>
+    """
+    return render_page("Product Details", content)
 
 # VULNERABILITY: Insecure JWT Implementation
 @app.route('/api/get-token')
@@ -1186,12 +4122,13 @@ def get_jwt_token():
     password = request.args.get('password', '')
     
     # Basic authentication check
-    if username in USERS and password == USERS[username]['password']:
+    user = USERS.get(username)
+    if user is not None and password == user['password']:
         # VULNERABILITY: Using a weak secret and including sensitive data
         payload = {
             'username': username,
-            'role': USERS[username]['role'],
-            'email': USERS[username]['email'],
+            'role': user['role'],
+            'email': user['email'],
             'exp': datetime.utcnow() + timedelta(hours=24)
         }
         
@@ -1250,26 +4187,31 @@ def download_file():
     
     try:
         # VULNERABILITY: Not sanitizing or restricting the file path
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        with open(file_path, 'rb') as f:
-            file_data = f.read()
-        
-        # Create a response with the file data
-        response = make_response(file_data)
-        response.headers['Content-Disposition'] = f'attachment; filename={os.path.basename(filename)}'
+        file_path = find_upload(get_upload_folder(), filename)
         
         # Try to guess the MIME type
         if filename.endswith('.txt'):
-            response.headers['Content-Type'] = 'text/plain'
+            mimetype = 'text/plain'
         elif filename.endswith('.pdf'):
-            response.headers['Content-Type'] = 'application/pdf'
+            mimetype = 'application/pdf'
         elif filename.endswith(('.jpg', '.jpeg')):
-            response.headers['Content-Type'] = 'image/jpeg'
+            mimetype = 'image/jpeg'
         elif filename.endswith('.png'):
-            response.headers['Content-Type'] = 'image/png'
+            mimetype = 'image/png'
         else:
-            response.headers['Content-Type'] = 'application/octet-stream'
+            mimetype = 'application/octet-stream'
+        
+        # Stream the file instead of reading it into memory. send_file hands the open file
+        # to the server's wsgi.file_wrapper (sendfile where available, chunked reads otherwise)
+        # and handles Range/If-Range, ETag/Last-Modified and 304s for us.
+        response = send_file(
+            os.path.abspath(file_path),
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=os.path.basename(filename),
+            conditional=True,
+            etag=True,
+        )
         
         return response
     except Exception as e:
@@ -1279,22 +4221,76 @@ def download_file():
 # VULNERABILITY: CORS Misconfiguration
 @app.route('/api/user-data')
 def user_data_api():
-    # VULNERABILITY: Adding permissive CORS headers
-    response = make_response(json.dumps({
-        'status': 'success',
-        'data': {
-            'users': [{'username': u, 'email': d['email'], 'role': d['role']} for u, d in USERS.items()]
-        }
-    }))
+    # ?limit=&after= returns one keyset page, otherwise every user is streamed.
+    # format=ndjson switches to one JSON object per line.
+    ndjson = request.args.get('format') == 'ndjson'
+    paginated = 'limit' in request.args or 'after' in request.args
+
+    if paginated:
+        after, limit = get_page_args(app.config['USER_PAGE_SIZE'], app.config['USER_MAX_PAGE_SIZE'])
+        page = USERS.page(after=after, limit=limit)
+        users = [{'username': u, 'email': d['email'], 'role': d['role']} for u, d in page]
+        next_cursor = page[-1][0] if len(page) == limit else None
+        if ndjson:
+            body = ''.join(json.dumps(user) + '\n' for user in users)
+        else:
+            body = json.dumps({'status': 'success', 'data': {'users': users}, 'next': next_cursor})
+        response = make_response(body)
+        if next_cursor is not None:
+            response.headers['Link'] = f'<{url_for("user_data_api", after=next_cursor, limit=limit, format=request.args.get("format"))}>; rel="next"'
+    else:
+        # Keeps the request context while streaming, USERS is looked up per tenant
+        response = Response(stream_with_context(stream_user_data(ndjson)))
     
+    # VULNERABILITY: Adding permissive CORS headers
     # Add CORS headers - Allow any origin
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE'
     response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-    response.headers['Content-Type'] = 'application/json'
+    response.headers['Content-Type'] = 'application/x-ndjson' if ndjson else 'application/json'
     
     return response
 
+def stream_user_data(ndjson=False):
+    """Yields the full user list as JSON (or NDJSON) text a page at a time."""
+    if not ndjson:
+        yield '{"status": "success", "data": {"users": ['
+    first = True
+    for page in USERS.iter_pages():
+        users = [json.dumps({'username': u, 'email': d['email'], 'role': d['role']}) for u, d in page]
+        if ndjson:
+            yield '\n'.join(users) + '\n'
+        else:
+            yield ('' if first else ', ') + ', '.join(users)
+        first = False
+    if not ndjson:
+        yield ']}}'
+
+# Form shown by GET /transfer-credit
+# VULNERABILITY: No CSRF token in form
+TRANSFER_CREDIT_FORM_HTML = minify_html("""
+    <div class="card">
+        <h3>Transfer Store Credit</h3>
+        <p>Current Store Credit: <strong>$50.00</strong></p>
+        <form method="post">
+            <div class="form-group">
+                <label for="target_user">Recipient Username:</label>
+                <input type="text" id="target_user" name="target_user" required>
+            </div>
+            <div class="form-group">
+                <label for="amount">Amount ($):</label>
+                <input type="number" id="amount" name="amount" min="0.01" step="0.01" required>
+            </div>
+            <input type="submit" value="Transfer Credits" class="btn">
+        </form>
+    </div>
+    
+    <div class="card">
+        <h3>Transaction History</h3>
+        <p><em>No recent transactions</em></p>
+    </div>
+    """)
+
 # VULNERABILITY: CSRF - Add a balance transfer with no CSRF protection
 @app.route('/transfer-credit', methods=['GET', 'POST'])
 def transfer_credit():
@@ -1321,37 +4317,13 @@ def transfer_credit():
         return redirect(url_for('transfer_credit'))
     
     # GET request - show form
-    # VULNERABILITY: No CSRF token in form
-    transfer_form = f"""
-    <div class="card">
-        <h3>Transfer Store Credit</h3>
-        <p>Current Store Credit: <strong>$50.00</strong></p>
-        <form method="post">
-            <div class="form-group">
-                <label for="target_user">Recipient Username:</label>
-                <input type="text" id="target_user" name="target_user" required>
-            </div>
-            <div class="form-group">
-                <label for="amount">Amount ($):</label>
-                <input type="number" id="amount" name="amount" min="0.01" step="0.01" required>
-            </div>
-            <input type="submit" value="Transfer Credits" class="btn">
-        </form>
-    </div>
-    
-    <div class="card">
-        <h3>Transaction History</h3>
-        <p><em>No recent transactions</em></p>
-    </div>
-    """
-    
     messages_html = ""
     if '_flashes' in session:
         flashed_messages = session.pop('_flashes')
         for category, message in flashed_messages:
             messages_html += f'<div class="flash {category}">{escape(message)}</div>'
     
-    return render_page("Transfer Store Credit", messages_html + transfer_form)
+    return render_page("Transfer Store Credit", messages_html + TRANSFER_CREDIT_FORM_HTML)
 
 # VULNERABILITY: Debug Endpoint with Info Leakage
 @app.route('/debug/system-info')
@@ -1365,13 +4337,15 @@ def debug_system_info():
     # VULNERABILITY: Exposing sensitive system information
     system_info = {
         'app_config': {
-            'secret_key': app.config['SECRET_KEY'],  # Leaking the secret key
-            'upload_folder': app.config['UPLOAD_FOLDER'],
+            'secret_key': get_tenant().secret_key if get_tenant() else app.config['SECRET_KEY'],  # Leaking the (lab's) secret key
+            'upload_folder': get_upload_folder(),
             'allowed_extensions': list(ALLOWED_EXTENSIONS),
             'api_key': HARDCODED_API_KEY
         },
         'environment': dict(os.environ),  # Leaking environment variables
         'python_version': sys.version,
+        'caches': {name: get_cache().stats() for name, get_cache in METRICS_CACHES.items()},
+        'tenants': get_tenant_registry().stats() if app.config['TENANT_MODE'] else None,
         'modules': sorted([m.__name__ for m in sys.modules.values() if m])
     }
     
@@ -1385,9 +4359,222 @@ def debug_system_info():
     
     return render_page("System Debug Info", info_html)
 
+# --- Startup ---
+
+# Paths of the pages static_page() serves, rendered and compressed before the first request
+STATIC_PAGE_PATHS = ('/', '/login', '/register', '/upload', '/import-catalog', '/check-supplier')
+
+def warm_static_pages():
+    """Fills STATIC_PAGES, called by the pre-fork server so every worker inherits them."""
+    for path in STATIC_PAGE_PATHS:
+        with app.test_request_context(path):
+            app.view_functions[request.endpoint](**request.view_args)
+
+# --- Pre-fork Server ---
+
+class PreforkRequestHandler(WSGIRequestHandler):
+    """Werkzeug's handler with access logging made optional."""
+
+    def log_request(self, *args, **kwargs):
+        if self.server.access_log:
+            super().log_request(*args, **kwargs)
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server for one worker process, connections are handled on a fixed thread pool.
+
+    A connection is only accepted while a pool thread is free, so a busy worker
+    leaves new connections to its idle siblings on the shared socket.
+    """
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, host, port, app, fd, threads, timeout, access_log):
+        handler = type('Handler', (PreforkRequestHandler,), {'timeout': timeout})
+        super().__init__(host, port, app, handler=handler, fd=fd)
+        self.socket.setblocking(False)  # Siblings race for every connection, the losers mustn't hang in accept()
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='http')
+        self.free_threads = threading.Semaphore(threads)
+        self.access_log = access_log
+        self.requests_handled = 0  # Werkzeug closes the connection after every response, so one per connection
+
+    def process_request(self, request, client_address):
+        self.requests_handled += 1
+        self.pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.free_threads.release()
+
+    def serve(self, stopping, max_requests=0):
+        """Accepts connections until `stopping` is set or max_requests were served, then drains and closes."""
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.socket, selectors.EVENT_READ)
+            while not stopping.is_set() and not (max_requests and self.requests_handled >= max_requests):
+                if not self.free_threads.acquire(timeout=1.0):
+                    continue
+                accepted = self.requests_handled
+                if selector.select(timeout=1.0):
+                    self._handle_request_noblock()
+                if self.requests_handled == accepted:
+                    self.free_threads.release()  # Nothing came in, or a sibling won the accept()
+        self.pool.shutdown(wait=True)
+        self.server_close()
+
+class PreforkServer:
+    """Loads the app once, then forks workers that share one listening socket.
+
+    SIGHUP replaces every worker with a fresh fork, SIGTERM/SIGINT stop the
+    workers gracefully, and a worker that exits (recycled or crashed) is
+    replaced. gc.freeze() before each fork keeps the preloaded objects out of
+    the collector, so their pages stay shared with the master.
+    """
+
+    def __init__(self, host, port, workers, threads, max_requests=0, max_requests_jitter=0,
+                 graceful_timeout=30.0, timeout=30.0, access_log=False):
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.timeout = timeout
+        self.access_log = access_log
+        self.workers = set()   # pids of current workers
+        self.retiring = set()  # pids of workers told to stop, still finishing their requests
+        self.socket = None
+        self._reload = False
+        self._stop = False
+
+    def run(self):
+        self.socket = socket.create_server((self.host, self.port), backlog=2048)
+        self._setup_metrics_dir()
+        warm_static_pages()
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, '_reload', True))
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, '_stop', True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, '_stop', True))
+        gc.collect()
+        print(f"Master {os.getpid()} listening on {self.host}:{self.port}, {self.worker_count} workers x {self.threads} threads")
+        try:
+            while not self._stop:
+                self.reap()
+                if self._reload:
+                    self._reload = False
+                    print(f"Master {os.getpid()} got SIGHUP, replacing workers")
+                    self.retire(self.workers)
+                while len(self.workers) < self.worker_count and not self._stop:
+                    self.spawn()
+                time.sleep(0.5)
+        finally:
+            self.retire(self.workers)
+            self.wait_for_retiring()
+            self.socket.close()
+            if self._own_metrics_dir:
+                shutil.rmtree(app.config['METRICS_DIR'], ignore_errors=True)
+
+    def _setup_metrics_dir(self):
+        # Workers must share a METRICS_DIR for /metrics to add them up, and files of
+        # a previous run's dead workers would otherwise be counted forever
+        self._own_metrics_dir = not app.config['METRICS_DIR']
+        if self._own_metrics_dir:
+            app.config['METRICS_DIR'] = tempfile.mkdtemp(prefix='trendy-tees-metrics-')
+        elif os.path.isdir(app.config['METRICS_DIR']):
+            for entry in os.scandir(app.config['METRICS_DIR']):
+                if entry.name.startswith('metrics-'):
+                    os.remove(entry.path)
+
+    def spawn(self):
+        gc.freeze()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                self.run_worker()
+            except BaseException as e:
+                print(f"Worker {os.getpid()} crashed: {e}") # Log real error
+                status = 1
+            finally:
+                os._exit(status)
+        self.workers.add(pid)
+
+    def run_worker(self):
+        stopping = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        server = PooledWSGIServer(self.host, self.port, app, fd=self.socket.fileno(), threads=self.threads,
+                                  timeout=self.timeout, access_log=self.access_log)
+        self.socket.close()
+        max_requests = self.max_requests and self.max_requests + random.randint(0, self.max_requests_jitter)
+        server.serve(stopping, max_requests)
+        REQUEST_METRICS.retire()
+        if not stopping.is_set():
+            print(f"Worker {os.getpid()} recycled after {server.requests_handled} requests")
+
+    def reap(self):
+        while True:
+            try:
+                pid, _status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.workers.discard(pid)
+            self.retiring.discard(pid)
+
+    def retire(self, pids):
+        for pid in list(pids):
+            self.workers.discard(pid)
+            self.retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.retiring.discard(pid)
+
+    def wait_for_retiring(self):
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.retiring and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in self.retiring:
+            print(f"Worker {pid} didn't stop within {self.graceful_timeout}s, killing it")
+            os.kill(pid, signal.SIGKILL)
+        while self.retiring:
+            self.reap()
+            time.sleep(0.1)
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Trendy Tees online store")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    # Workers share nothing but the sqlite user store: with the in-memory one each would have its own accounts
+    shared_users = app.config['USER_STORE'] == 'sqlite'
+    parser.add_argument('--workers', type=int, default=(os.cpu_count() or 1) if shared_users else 1,
+                        help="worker processes (default: CPU count with USER_STORE=sqlite, otherwise 1)")
+    parser.add_argument('--threads', type=int, default=4, help="request threads per worker (default: %(default)s)")
+    parser.add_argument('--max-requests', type=int, default=0, help="recycle a worker after this many requests, 0 never (default: %(default)s)")
+    parser.add_argument('--max-requests-jitter', type=int, default=0, help="random extra requests per worker so they don't all recycle at once")
+    parser.add_argument('--graceful-timeout', type=float, default=30.0, help="seconds a stopping worker gets to finish (default: %(default)s)")
+    parser.add_argument('--timeout', type=float, default=30.0, help="seconds to wait on a silent client socket (default: %(default)s)")
+    parser.add_argument('--access-log', action='store_true', help="log every request")
+    parser.add_argument('--debug', action='store_true', help="run the single-process Werkzeug debug server with the reloader instead")
+    args = parser.parse_args()
+    if args.workers > 1 and not shared_users:
+        parser.error("--workers > 1 needs USER_STORE=sqlite, with USER_STORE=memory every worker would have its own users")
+
     print("Starting Trendy Tees online store...")
-    print(f"Store running at http://0.0.0.0:5001")
+    print(f"Store running at http://{args.host}:{args.port}")
     # Default admin user credentials reminder
     print(f"Default admin credentials: username='admin', password='admin123'")
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    if args.debug:
+        app.run(debug=True, host=args.host, port=args.port)
+    else:
+        PreforkServer(args.host, args.port, args.workers, args.threads, max_requests=args.max_requests,
+                      max_requests_jitter=args.max_requests_jitter, graceful_timeout=args.graceful_timeout,
+                      timeout=args.timeout, access_log=args.access_log).run()
@@ -0,0 +1,97 @@
+"""Shared helpers for the benchmark scripts.
+
+The scripts are meant to be run from the repository root, e.g.
+``python benchmarks/bench_download.py``.
+"""
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+MB = 1024 * 1024
+
+
+def load_app(upload_folder=None):
+    """Imports the Flask app, optionally pointing UPLOAD_FOLDER somewhere else."""
+    import app as app_module
+    if upload_folder is not None:
+        os.makedirs(upload_folder, exist_ok=True)
+        app_module.app.config['UPLOAD_FOLDER'] = upload_folder
+    return app_module
+
+
+def parse_sizes(value):
+    """Parses a comma separated list of sizes like '1M,100M,1G' into bytes."""
+    units = {'K': 1024, 'M': MB, 'G': 1024 * MB}
+    sizes = []
+    for part in value.split(','):
+        part = part.strip().upper()
+        if part[-1] in units:
+            sizes.append(int(float(part[:-1]) * units[part[-1]]))
+        else:
+            sizes.append(int(part))
+    return sizes
+
+
+def fmt_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024 or unit == 'GB':
+            return f"{n:.1f} {unit}" if unit != 'B' else f"{n} B"
+        n /= 1024
+
+
+def measure(fn, *args, **kwargs):
+    """Runs fn once and returns (result, seconds, peak traced Python memory in bytes)."""
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def measure_forked(fn, *args, **kwargs):
+    """Runs fn in a forked child and returns (result, seconds, child peak RSS in bytes).
+
+    Unlike measure() this has no tracing overhead, so it suits the large inputs,
+    and the peak RSS is that of the child alone (POSIX only).
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            payload = pickle.dumps((result, time.perf_counter() - start))
+        except BaseException as e:
+            payload = pickle.dumps((e, None))
+        with os.fdopen(write_fd, 'wb') as f:
+            f.write(payload)
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as f:
+        result, elapsed = pickle.loads(f.read())
+    _, _, usage = os.wait4(pid, 0)
+    if elapsed is None:
+        raise result
+    return result, elapsed, usage.ru_maxrss * 1024
+
+
+def write_file(path, size, chunk=MB):
+    """Writes size bytes of filler data to path without holding it all in memory."""
+    block = os.urandom(min(chunk, size) or 1)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
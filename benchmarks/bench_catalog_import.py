@@ -0,0 +1,83 @@
+"""Peak memory and throughput of the catalog importer across catalog sizes.
+
+Generates synthetic <catalog> files on disk and runs them through
+iter_catalog_products(), which is what /import-catalog uses. The legacy
+read/decode/fromstring/findall path is measured too, up to --legacy-max,
+since at large sizes it simply runs out of memory. Each run happens in a
+forked child so the reported peak RSS belongs to that parse alone; the
+"idle" row is the child's RSS before it parses anything. With --store the
+products are also written to a scratch SQLite catalog store, as the route
+does.
+
+    python benchmarks/bench_catalog_import.py --sizes 1M,100M,1G
+"""
+import argparse
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+
+from _common import fmt_bytes, load_app, measure_forked, parse_sizes
+
+PRODUCT = "  <product><name>Synthetic Tee {0}</name><sku>TS-{0:08d}</sku><price>$19.99</price></product>\n"
+
+
+def write_catalog(path, size):
+    """Writes a catalog of roughly size bytes and returns the product count."""
+    count = 0
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("<catalog>\n")
+        while written < size:
+            batch = ''.join(PRODUCT.format(count + i) for i in range(1000))
+            f.write(batch)
+            written += len(batch)
+            count += 1000
+        f.write("</catalog>\n")
+    return count
+
+
+def streaming_import(app_module, path, store=False):
+    with open(path, 'rb') as f:
+        products = app_module.iter_catalog_products(f)
+        if store:
+            products = app_module.save_catalog_products(products)
+        return sum(1 for _ in products)
+
+
+def legacy_import(path):
+    with open(path, 'rb') as f:
+        tree = ET.fromstring(f.read().decode('utf-8'))
+    return len([p.findtext('sku') for p in tree.findall('.//product')])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1M,100M,1G', help="comma separated catalog sizes (default: %(default)s)")
+    parser.add_argument('--store', action='store_true', help="also write products to a scratch catalog store")
+    parser.add_argument('--legacy-max', default='100M', help="largest size to run the legacy parser on (default: %(default)s)")
+    args = parser.parse_args()
+    legacy_max = parse_sizes(args.legacy_max)[0]
+
+    app_module = load_app()
+    print(f"{'size':>10} {'products':>10} {'seconds':>8} {'products/s':>11} {'peak RSS':>10} {'legacy RSS':>12}")
+    _, _, idle = measure_forked(lambda: None)
+    print(f"{'idle':>10} {'':>10} {'':>8} {'':>11} {fmt_bytes(idle):>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        app_module.app.config['CATALOG_DB_PATH'] = os.path.join(tmp, 'catalog.db')
+        for size in parse_sizes(args.sizes):
+            path = os.path.join(tmp, f'catalog-{size}.xml')
+            expected = write_catalog(path, size)
+
+            count, elapsed, peak = measure_forked(streaming_import, app_module, path, store=args.store)
+            assert count == expected, (count, expected)
+            legacy = '-'
+            if size <= legacy_max:
+                _, _, legacy_peak = measure_forked(legacy_import, path)
+                legacy = fmt_bytes(legacy_peak)
+
+            print(f"{fmt_bytes(os.path.getsize(path)):>10} {count:>10} {elapsed:>8.2f} {count / elapsed:>11.0f} {fmt_bytes(peak):>10} {legacy:>12}")
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
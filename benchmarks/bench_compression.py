@@ -0,0 +1,67 @@
+"""Bytes on the wire and CPU per request with and without response compression.
+
+Requests each page through the Flask test client once per encoding the app
+can produce (identity, gzip and br when brotli is installed) and reports the
+body size and the process CPU time per request. The static pages are served
+from the copies compressed at startup, /lfi joins the file's gzip member compressed
+once to small members compressed per request, the others are compressed per request
+(and /api/user-data is streamed, so it is compressed chunk by chunk).
+
+    python benchmarks/bench_compression.py --iterations 500 --users 10000
+"""
+import argparse
+import time
+
+from _common import fmt_bytes, load_app
+
+PAGES = [
+    ('/', 'static'),
+    ('/login', 'static'),
+    ('/import-catalog', 'static'),
+    ('/ssti?name=Trendy%20Tees', 'dynamic'),
+    ('/lfi?file=classic_crew_neck_specs.txt', 'members'),
+    ('/api/user-data?limit=1000', 'dynamic'),
+    ('/api/user-data', 'streamed'),
+]
+
+
+def run(client, path, encoding, iterations):
+    headers = {'Accept-Encoding': encoding}
+    response = client.get(path, headers=headers)
+    if response.headers.get('Content-Encoding', 'identity') != encoding:
+        # Body under COMPRESS_MIN_SIZE, the app sends it as it is
+        return None, None
+    size = len(response.data)
+    start = time.process_time()
+    for _ in range(iterations):
+        client.get(path, headers=headers).close()
+    return size, (time.process_time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--users', type=int, default=10000, help="accounts in the user store (default: %(default)s)")
+    args = parser.parse_args()
+
+    app_module = load_app()
+    for i in range(args.users - len(app_module.USERS)):
+        app_module.USERS.create_user(f'bench-user-{i:08d}', {'password': 'secret', 'email': f'bench-user-{i}@example.com',
+                                                              'role': 'user', 'created_at': 0.0})
+    client = app_module.app.test_client(use_cookies=False)
+    encodings = ['identity', *reversed(app_module.available_encodings())]
+
+    print(f"{'page':>40} {'kind':>8} {'encoding':>9} {'bytes':>10} {'ratio':>6} {'CPU us/req':>11}")
+    for path, kind in PAGES:
+        identity_size = None
+        for encoding in encodings:
+            size, cpu = run(client, path, encoding, args.iterations if kind != 'streamed' else max(1, args.iterations // 50))
+            if size is None:
+                print(f"{path[:40]:>40} {kind:>8} {encoding:>9} {'(not compressed, under COMPRESS_MIN_SIZE)':>29}")
+                continue
+            identity_size = identity_size or size
+            print(f"{path[:40]:>40} {kind:>8} {encoding:>9} {fmt_bytes(size):>10} {size / identity_size:>6.2f} {cpu * 1e6:>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Peak memory of /download as the file size grows.
+
+Streams each file through the Flask test client without buffering the
+response and records the peak Python heap. The streamed route should stay
+flat; the "read all" column is what the old f.read() implementation cost.
+
+    python benchmarks/bench_download.py --sizes 1M,16M,128M
+"""
+import argparse
+import os
+import tempfile
+
+from _common import fmt_bytes, load_app, measure, parse_sizes, write_file
+
+
+def stream_download(client, name):
+    response = client.get(f'/download?file={name}', buffered=False)
+    total = 0
+    for chunk in response.response:
+        total += len(chunk)
+    response.close()
+    return response.status_code, total
+
+
+def read_all(path):
+    with open(path, 'rb') as f:
+        return len(f.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1M,16M,128M', help="comma separated file sizes (default: %(default)s)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app_module = load_app(upload_folder=tmp)
+        client = app_module.app.test_client()
+
+        print(f"{'size':>10} {'status':>6} {'seconds':>8} {'MB/s':>8} {'streamed peak':>14} {'read all peak':>14}")
+        for size in parse_sizes(args.sizes):
+            name = f'bench-{size}.bin'
+            path = os.path.join(tmp, name)
+            write_file(path, size)
+
+            (status, total), elapsed, peak = measure(stream_download, client, name)
+            assert total == size, (total, size)
+            _, _, buffered_peak = measure(read_all, path)
+
+            rate = size / elapsed / (1024 * 1024) if elapsed else 0
+            print(f"{fmt_bytes(size):>10} {status:>6} {elapsed:>8.3f} {rate:>8.1f} {fmt_bytes(peak):>14} {fmt_bytes(buffered_peak):>14}")
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Cold vs warm /ssti preview renders with the compiled-template cache.
+
+"cold" clears the cache before every render, so each one lexes, parses and
+compiles the template like the old render_template_string call did; "warm"
+renders the same few messages again and hits the cache. Both the bare
+template render and the full request through the test client are timed.
+
+    python benchmarks/bench_ssti.py --iterations 2000
+"""
+import argparse
+import time
+from urllib.parse import quote
+
+from _common import load_app
+
+NAMES = ['Your Text Here', 'Hello World', 'Trendy Tees Rock', '{{ 7 * 7 }}']
+
+
+def template_for(name):
+    return f"<h3>Your Custom Message:</h3><div class='card' style='font-size: 1.5em; text-align: center;'>{name}</div><p>Enter your desired message in the 'name' parameter in the URL.</p>"
+
+
+def time_renders(app_module, iterations, cold):
+    cache = app_module.get_template_cache()
+    with app_module.app.test_request_context('/ssti'):
+        start = time.perf_counter()
+        for i in range(iterations):
+            if cold:
+                cache.clear()
+            app_module.render_cached_template_string(template_for(NAMES[i % len(NAMES)]))
+        return (time.perf_counter() - start) / iterations
+
+
+def time_requests(app_module, iterations, cold):
+    cache = app_module.get_template_cache()
+    client = app_module.app.test_client()
+    urls = [f'/ssti?name={quote(name)}' for name in NAMES]
+    start = time.perf_counter()
+    for i in range(iterations):
+        if cold:
+            cache.clear()
+        client.get(urls[i % len(urls)])
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    app_module = load_app()
+    print(f"{'measure':>10} {'cold us':>10} {'warm us':>10} {'speedup':>8}")
+    for label, fn in (('render', time_renders), ('request', time_requests)):
+        cold = fn(app_module, args.iterations, cold=True)
+        fn(app_module, len(NAMES), cold=False)  # prime
+        warm = fn(app_module, args.iterations, cold=False)
+        print(f"{label:>10} {cold * 1e6:>10.1f} {warm * 1e6:>10.1f} {cold / warm:>7.1f}x")
+    print("cache:", app_module.get_template_cache().stats())
+
+
+if __name__ == '__main__':
+    main()
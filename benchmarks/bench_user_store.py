@@ -0,0 +1,76 @@
+"""Registration and login throughput of the user store backends at 1, 4 and 16 workers.
+
+Each worker is a forked process with its own Flask test client, the way a
+pre-fork server runs the app. Workers register fresh accounts and then log
+in with them for --seconds, and the per-worker counts are summed. With the
+memory backend every worker only sees its own users; the sqlite backend is
+shared through one WAL database file.
+
+    python benchmarks/bench_user_store.py --backends memory,sqlite --workers 1,4,16
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from _common import ROOT  # noqa: F401 (puts the repo on sys.path)
+
+
+def worker(backend, db_path, seconds, worker_id, results):
+    os.environ['USER_STORE'] = backend
+    os.environ['USER_DB_PATH'] = db_path
+    import app as app_module
+    # No cookie jar, otherwise the unread flash messages pile up in the session cookie
+    client = app_module.app.test_client(use_cookies=False)
+
+    registered = logins = 0
+    names = []
+    deadline = time.perf_counter() + seconds / 2
+    while time.perf_counter() < deadline:
+        name = f'bench-{os.getpid()}-{registered}'
+        response = client.post('/register', data={'username': name, 'password': 'secret', 'email': f'{name}@example.com'})
+        assert response.status_code == 302
+        names.append(name)
+        registered += 1
+
+    deadline = time.perf_counter() + seconds / 2
+    while time.perf_counter() < deadline:
+        response = client.post('/login', data={'username': names[logins % len(names)], 'password': 'secret'})
+        assert response.headers['Location'] == '/', response.headers['Location']
+        logins += 1
+
+    results.put((registered, logins))
+
+
+def run(backend, workers, seconds):
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'users.db')
+        procs = [ctx.Process(target=worker, args=(backend, db_path, seconds, i, results)) for i in range(workers)]
+        for p in procs:
+            p.start()
+        counts = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+    half = seconds / 2
+    return sum(c[0] for c in counts) / half, sum(c[1] for c in counts) / half
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', default='memory,sqlite')
+    parser.add_argument('--workers', default='1,4,16')
+    parser.add_argument('--seconds', type=float, default=4.0, help="run time per measurement, split between the two phases")
+    args = parser.parse_args()
+
+    print(f"{'backend':>8} {'workers':>8} {'register/s':>11} {'login/s':>9}")
+    for backend in args.backends.split(','):
+        for workers in [int(w) for w in args.workers.split(',')]:
+            register_rate, login_rate = run(backend, workers, args.seconds)
+            print(f"{backend:>8} {workers:>8} {register_rate:>11.0f} {login_rate:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
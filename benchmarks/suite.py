@@ -0,0 +1,325 @@
+"""Requests/sec and p50/p99 latency for the hot routes, with a baseline compare.
+
+"run" sets up a scratch store (uploads, catalog database, --users accounts),
+then drives every scenario for --seconds, either in-process through the
+Flask test client or over real sockets against a server forked off after
+the setup, with --concurrency keep-alive client threads. Results are written
+as JSON. "compare" reads two result files and flags scenarios whose
+requests/sec dropped, or whose p50/p99 rose, by more than --threshold; it
+exits with status 1 when it finds any.
+
+    python benchmarks/suite.py run --mode inprocess --output baseline.json
+    python benchmarks/suite.py run --mode socket --concurrency 4 --output current.json
+    python benchmarks/suite.py compare baseline.json current.json --threshold 0.10
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlencode
+
+from _common import ROOT, fmt_bytes, parse_sizes, write_file
+from bench_catalog_import import PRODUCT
+
+FORM = 'application/x-www-form-urlencoded'
+BOUNDARY = 'trendy-tees-bench-boundary'
+
+
+class Scenario:
+    """One benchmarked route. request(i) returns (method, path, body, content type)."""
+
+    def __init__(self, name, request, expect=(200,)):
+        self.name = name
+        self.request = request
+        self.expect = expect
+
+
+def catalog_upload(products):
+    xml = '<catalog>\n' + ''.join(PRODUCT.format(i) for i in range(products)) + '</catalog>\n'
+    body = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="xml_file"; filename="catalog.xml"\r\n'
+            f'Content-Type: text/xml\r\n\r\n{xml}\r\n--{BOUNDARY}--\r\n').encode('utf-8')
+    return body, f'multipart/form-data; boundary={BOUNDARY}'
+
+
+def build_scenarios(app_module, tmp, args):
+    """Prepares the scratch data and returns the scenarios to run."""
+    upload_folder = os.path.join(tmp, 'uploads')
+    os.makedirs(upload_folder, exist_ok=True)
+    app_module.app.config['UPLOAD_FOLDER'] = upload_folder
+    app_module.app.config['CATALOG_DB_PATH'] = os.path.join(tmp, 'catalog.db')
+
+    users = app_module.USERS
+    for i in range(args.users - len(users)):
+        users.create_user(f'bench-user-{i:08d}', {'password': 'secret', 'email': f'bench-user-{i}@example.com',
+                                                  'role': 'user', 'created_at': 0.0})
+
+    registrations = itertools.count()
+    wishlist = {'wishlist_id': 'wl-abc-789', 'items': ['T001', 'T004']}
+    scenarios = [
+        Scenario('index', lambda i: ('GET', '/', None, None)),
+        Scenario('login_post', lambda i: ('POST', '/login', urlencode({'username': 'admin', 'password': 'admin123'}), FORM),
+                 expect=(302,)),
+        Scenario('register_post', lambda i: ('POST', '/register', urlencode(
+            {'username': f'bench-{os.getpid()}-{next(registrations)}', 'password': 'secret', 'email': 'bench@example.com'}), FORM),
+                 expect=(302,)),
+        Scenario('ssti', lambda i: ('GET', '/ssti?name=' + quote('Trendy Tees Rock'), None, None)),
+        Scenario('deserialize_pickle', lambda i: ('GET', '/deserialize?data=' + app_module.HOMEPAGE_WISHLIST_CODE, None, None)),
+        Scenario('deserialize_w1', lambda i, code=app_module.encode_wishlist(wishlist): ('GET', '/deserialize?data=' + code, None, None)),
+        Scenario(f'user_data_page_{args.users}', lambda i: ('GET', '/api/user-data?limit=100', None, None)),
+        Scenario(f'user_data_all_{args.users}', lambda i: ('GET', '/api/user-data?format=ndjson', None, None)),
+    ]
+    for products in [int(n) for n in args.catalog_products.split(',')]:
+        body, content_type = catalog_upload(products)
+        scenarios.append(Scenario(f'import_catalog_{products}',
+                                  lambda i, body=body, content_type=content_type: ('POST', '/import-catalog', body, content_type)))
+    for size in parse_sizes(args.download_sizes):
+        name = f'bench-{size}.bin'
+        write_file(os.path.join(upload_folder, name), size)
+        scenarios.append(Scenario(f'download_{fmt_bytes(size).replace(" ", "").replace(".0", "")}',
+                                  lambda i, name=name: ('GET', f'/download?file={name}', None, None)))
+
+    if args.only:
+        wanted = args.only.split(',')
+        scenarios = [s for s in scenarios if any(w in s.name for w in wanted)]
+    return scenarios
+
+
+# --- Drivers ---
+
+def inprocess_caller(app_module):
+    """Returns call(method, path, body, content_type) -> status, through the Flask test client."""
+    client = app_module.app.test_client(use_cookies=False)
+
+    def call(method, path, body, content_type):
+        response = client.open(path, method=method, data=body, content_type=content_type, buffered=False)
+        for _ in response.response:
+            pass  # Drain the body the way a server would, without holding it
+        response.close()
+        return response.status_code
+
+    return call
+
+
+def socket_caller(port):
+    """Returns a call() like inprocess_caller's, over one keep-alive connection to the server."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+    def call(method, path, body, content_type):
+        headers = {'Content-Type': content_type} if content_type else {}
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            while response.read(65536):
+                pass
+        except (OSError, http.client.HTTPException):
+            conn.close()  # Reconnects on the next request
+            raise
+        return response.status
+
+    return call
+
+
+def start_server(app_module):
+    """Forks a threaded HTTP/1.1 server for the app and returns (pid, port)."""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True, request_handler=KeepAliveHandler)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            server.serve_forever()
+        finally:
+            os._exit(0)
+    server.socket.close()
+    return pid, server.port
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_scenario(scenario, make_caller, concurrency, seconds, warmup):
+    """Runs one scenario for `seconds` across `concurrency` threads and returns its stats."""
+    counter = itertools.count()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        call = make_caller()
+        for _ in range(warmup):
+            call(*scenario.request(next(counter)))
+        start_barrier.wait()
+        own, failed = [], 0
+        deadline = time.perf_counter() + seconds
+        while True:
+            request = scenario.request(next(counter))
+            start = time.perf_counter()
+            try:
+                ok = call(*request) in scenario.expect
+            except (OSError, http.client.HTTPException):
+                ok = False
+            end = time.perf_counter()
+            own.append(end - start)
+            failed += not ok
+            if end >= deadline:
+                break
+        with lock:
+            latencies.extend(own)
+            errors.append(failed)
+
+    start_barrier = threading.Barrier(concurrency + 1)
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'rps': len(latencies) / elapsed,
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        # The user store reads its settings at import, so point it at the scratch folder first
+        os.environ.setdefault('USER_DB_PATH', os.path.join(tmp, 'users.db'))
+        import app as app_module
+        scenarios = build_scenarios(app_module, tmp, args)
+
+        server_pid = None
+        if args.mode == 'socket':
+            server_pid, port = start_server(app_module)
+            make_caller = lambda: socket_caller(port)
+        else:
+            make_caller = lambda: inprocess_caller(app_module)
+
+        results = {}
+        try:
+            print(f"{'scenario':>24} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}", file=sys.stderr)
+            for scenario in scenarios:
+                stats = run_scenario(scenario, make_caller, args.concurrency, args.seconds, args.warmup)
+                results[scenario.name] = stats
+                print(f"{scenario.name:>24} {stats['requests']:>9} {stats['errors']:>7} {stats['rps']:>9.1f} "
+                      f"{stats['p50_ms']:>9.2f} {stats['p99_ms']:>9.2f}", file=sys.stderr)
+        finally:
+            if server_pid is not None:
+                os.kill(server_pid, 15)
+                os.waitpid(server_pid, 0)
+
+    report = {
+        'meta': {
+            'mode': args.mode,
+            'concurrency': args.concurrency,
+            'seconds': args.seconds,
+            'users': args.users,
+            'user_store': app_module.app.config['USER_STORE'],
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    for key in ('mode', 'concurrency', 'users'):
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            print(f"warning: {key} differs ({baseline['meta'].get(key)} vs {current['meta'].get(key)})")
+
+    regressions = 0
+    print(f"{'scenario':>24} {'req/s':>8} {'p50':>8} {'p99':>8}")
+    for name in sorted(set(baseline['results']) | set(current['results'])):
+        old, new = baseline['results'].get(name), current['results'].get(name)
+        if old is None or new is None:
+            print(f"{name:>24} {'only in ' + ('current' if old is None else 'baseline'):>26}")
+            continue
+        rps = new['rps'] / old['rps'] - 1
+        p50 = new['p50_ms'] / old['p50_ms'] - 1
+        p99 = new['p99_ms'] / old['p99_ms'] - 1
+        flags = []
+        if rps < -args.threshold:
+            flags.append('req/s')
+        if p50 > args.threshold:
+            flags.append('p50')
+        if p99 > args.threshold:
+            flags.append('p99')
+        if new['errors'] > old['errors']:
+            flags.append('errors')
+        regressions += bool(flags)
+        print(f"{name:>24} {rps:>+8.1%} {p50:>+8.1%} {p99:>+8.1%}" + (f"  REGRESSION ({', '.join(flags)})" if flags else ''))
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="run the scenarios and write JSON results")
+    run_parser.add_argument('--mode', choices=('inprocess', 'socket'), default='inprocess')
+    run_parser.add_argument('--concurrency', type=int, default=1, help="client threads (default: %(default)s)")
+    run_parser.add_argument('--seconds', type=float, default=2.0, help="measured run time per scenario (default: %(default)s)")
+    run_parser.add_argument('--warmup', type=int, default=3, help="unmeasured requests per thread first (default: %(default)s)")
+    run_parser.add_argument('--users', type=int, default=100000, help="accounts in the user store (default: %(default)s)")
+    run_parser.add_argument('--catalog-products', default='100,10000', help="products per uploaded catalog (default: %(default)s)")
+    run_parser.add_argument('--download-sizes', default='1M,64M', help="downloaded file sizes (default: %(default)s)")
+    run_parser.add_argument('--only', help="comma separated substrings, only matching scenarios run")
+    run_parser.add_argument('--output', help="result file (default: stdout)")
+
+    compare_parser = commands.add_parser('compare', help="flag regressions of a result file against a baseline")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.10, help="allowed relative change (default: %(default)s)")
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()